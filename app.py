@@ -1,12 +1,34 @@
 from __future__ import annotations
 
+import contextvars
+import cProfile
+import functools
+import hashlib
+import hmac
 import json
+import marshal
+import math
+import mmap
 import os
-from typing import Any, Dict, List, Tuple
-
+import queue
+import random
+import re
+import sqlite3
+import pstats
+import struct
+import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Tuple
+
+import numpy as np
 import requests
 from dotenv import load_dotenv
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, g, jsonify, render_template, request, url_for
 from requests import exceptions as requests_exceptions
 
 
@@ -25,10 +47,100 @@ GOOGLE_API_BASE_URL = os.getenv(
     "GOOGLE_API_BASE_URL", "https://generativelanguage.googleapis.com"
 )
 NOMINATIM_ENDPOINT = "https://nominatim.openstreetmap.org/search"
+NOMINATIM_LOOKUP_ENDPOINT = "https://nominatim.openstreetmap.org/lookup"
 OSRM_ENDPOINT = "https://router.project-osrm.org/route/v1"
+OSRM_FALLBACK_ENDPOINT = "https://routing.openstreetmap.de"
 NOMINATIM_USER_AGENT = os.getenv(
     "NOMINATIM_USER_AGENT", "MapaInteligente/1.0 (contacto@ejemplo.com)"
 )
+# Estado compartido entre procesos (cachés, ritmo de peticiones, versión de
+# Gemini): "sqlite:///ruta.db" (por defecto), "redis://host:6379/0" o "memory://".
+SHARED_CACHE_URL = os.getenv(
+    "SHARED_CACHE_URL",
+    "sqlite:///" + os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "shared_cache.sqlite3"),
+)
+# Segundos que una entrada compartida se mantiene además en la memoria de cada proceso
+NEAR_CACHE_TTL = float(os.getenv("NEAR_CACHE_TTL", "60"))
+# Política de uso de Nominatim: como máximo una petición por segundo (0 = sin límite)
+NOMINATIM_MIN_INTERVAL = float(os.getenv("NOMINATIM_MIN_INTERVAL", "1.0"))
+# Espera máxima por un turno; si la cola es más larga la petición se rechaza
+NOMINATIM_MAX_WAIT = float(os.getenv("NOMINATIM_MAX_WAIT", "10"))
+# Trazas por petición: fracción de peticiones muestreadas (0 = desactivado) y
+# fichero JSON Lines, compatible con OTLP/JSON, al que se exportan los spans.
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_EXPORT_PATH = os.getenv(
+    "TRACE_EXPORT_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "traces.jsonl")
+)
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "10000"))
+# Al superar este tamaño el fichero pasa a <ruta>.1 (se conserva una sola copia)
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(50 * 1024 * 1024)))
+# Búsquedas por categoría: a partir de SEARCH_PAGED_THRESHOLD resultados se
+# pagina Nominatim por teselas del viewbox y se agrupan los puntos en el servidor.
+SEARCH_PAGED_THRESHOLD = int(os.getenv("SEARCH_PAGED_THRESHOLD", "50"))
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "1000"))
+SEARCH_TILE_SPLIT = int(os.getenv("SEARCH_TILE_SPLIT", "2"))
+SEARCH_MAX_PAGES = int(os.getenv("SEARCH_MAX_PAGES", "10"))
+# Segundos de plazo que se reservan para agrupar y para el resto del plan
+SEARCH_DEADLINE_RESERVE = float(os.getenv("SEARCH_DEADLINE_RESERVE", "5"))
+CLUSTER_RADIUS_PX = float(os.getenv("CLUSTER_RADIUS_PX", "60"))
+CLUSTER_MAX_ZOOM = int(os.getenv("CLUSTER_MAX_ZOOM", "17"))
+# Recursos del frontend: build_assets.py los publica con huella en static/dist
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+VENDOR_MANIFEST_PATH = os.path.join(STATIC_DIR, "vendor.json")
+ASSET_MANIFEST_PATH = os.path.join(STATIC_DIR, "dist", "manifest.json")
+# Token para las rutas /api/admin (sin token, esas rutas no existen)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_DIR = os.getenv(
+    "PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "profiles")
+)
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+ROUTE_CACHE_TTL = int(os.getenv("ROUTE_CACHE_TTL", "86400"))
+ROUTE_CACHE_SIZE = int(os.getenv("ROUTE_CACHE_SIZE", "256"))
+# router.project-osrm.org admite como mucho una petición por segundo
+OSRM_MIN_INTERVAL = float(os.getenv("OSRM_MIN_INTERVAL", "1.0"))
+OSRM_MAX_WAIT = float(os.getenv("OSRM_MAX_WAIT", "10"))
+# Límite por cliente de /api/osrm
+OSRM_RATE_PER_MINUTE = float(os.getenv("OSRM_RATE_PER_MINUTE", "30"))
+OSRM_BURST = int(os.getenv("OSRM_BURST", "10"))
+# Control de admisión de /api/assistant
+ASSISTANT_MAX_IN_FLIGHT = int(os.getenv("ASSISTANT_MAX_IN_FLIGHT", "4"))  # por proceso
+ASSISTANT_QUEUE_SIZE = int(os.getenv("ASSISTANT_QUEUE_SIZE", "8"))
+ASSISTANT_QUEUE_TIMEOUT = float(os.getenv("ASSISTANT_QUEUE_TIMEOUT", "3"))
+ASSISTANT_RATE_PER_MINUTE = float(os.getenv("ASSISTANT_RATE_PER_MINUTE", "10"))  # por cliente
+ASSISTANT_BURST = int(os.getenv("ASSISTANT_BURST", "3"))
+ASSISTANT_DEADLINE = float(os.getenv("ASSISTANT_DEADLINE", "45"))
+GEOCODE_CACHE_TTL = int(os.getenv("GEOCODE_CACHE_TTL", "3600"))
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", "512"))
+# Sugerencias de /api/geocode?autocomplete=1. La política de uso de
+# nominatim.openstreetmap.org prohíbe el autocompletado, así que solo se activa
+# apuntando AUTOCOMPLETE_ENDPOINT a una instancia propia de Nominatim.
+AUTOCOMPLETE_ENDPOINT = os.getenv("AUTOCOMPLETE_ENDPOINT", "").strip()
+AUTOCOMPLETE_MIN_INTERVAL = float(os.getenv("AUTOCOMPLETE_MIN_INTERVAL", "0"))
+AUTOCOMPLETE_MIN_CHARS = int(os.getenv("AUTOCOMPLETE_MIN_CHARS", "3"))
+AUTOCOMPLETE_LIMIT = int(os.getenv("AUTOCOMPLETE_LIMIT", "5"))
+# Límite por cliente de /api/geocode
+GEOCODE_RATE_PER_MINUTE = float(os.getenv("GEOCODE_RATE_PER_MINUTE", "60"))
+GEOCODE_BURST = int(os.getenv("GEOCODE_BURST", "15"))
+# Límite por cliente de /api/geometry (cada fallo de caché es un /lookup a Nominatim)
+GEOMETRY_RATE_PER_MINUTE = float(os.getenv("GEOMETRY_RATE_PER_MINUTE", "30"))
+GEOMETRY_BURST = int(os.getenv("GEOMETRY_BURST", "10"))
+# Precarga especulativa: máximo de candidatos por consulta (0 la desactiva)
+# y de geocodificaciones especulativas en vuelo a la vez.
+PREFETCH_MAX_CANDIDATES = int(os.getenv("PREFETCH_MAX_CANDIDATES", "4"))
+PREFETCH_MAX_PENDING = int(os.getenv("PREFETCH_MAX_PENDING", "8"))
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "2"))
+PREFETCH_WAIT_TIMEOUT = float(os.getenv("PREFETCH_WAIT_TIMEOUT", "15"))
+# "lazy": la búsqueda de áreas no descarga polígonos; el cliente pide después
+# la geometría del objeto OSM elegido a /api/geometry. "eager": comportamiento clásico.
+GEOMETRY_FETCH_MODE = os.getenv("GEOMETRY_FETCH_MODE", "lazy").strip().lower()
+GEOMETRY_CACHE_TTL = int(os.getenv("GEOMETRY_CACHE_TTL", "86400"))
+GEOMETRY_CACHE_SIZE = int(os.getenv("GEOMETRY_CACHE_SIZE", "64"))
+# Directorio del almacén binario de geometrías (vacío = solo en memoria)
+GEOMETRY_STORE_DIR = os.getenv(
+    "GEOMETRY_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "geometry")
+)
+# Tolerancia de simplificación en píxeles de pantalla para el zoom solicitado
+GEOMETRY_SIMPLIFY_PIXELS = float(os.getenv("GEOMETRY_SIMPLIFY_PIXELS", "1.0"))
 
 SYSTEM_PROMPT = (
     "Eres 'Antigravity Map Assistant', un experto en geolocalización y análisis espacial para una aplicación de mapas interactivos.\n"
@@ -37,7 +149,7 @@ SYSTEM_PROMPT = (
     "1. `place(query: str, include_polygon: bool)`: Busca un lugar específico único.\n"
     "   - Usa `include_polygon: true` si el usuario pide ver el trazado de una CALLE, RÍO, o el contorno de un lugar.\n"
     "2. `search(query: str, limit: int)`: Busca MÚLTIPLES ubicaciones de una cadena, tipo de negocio o categoría (ej. 'Zaras en Madrid', 'museos en París').\n"
-    "   - 'limit' por defecto 10, máximo 20.\n"
+    "   - 'limit' por defecto 10: hasta 20 en búsquedas normales y hasta 1000 solo en categorías amplias ('todas las farmacias de Madrid'), que el servidor pagina y agrupa.\n"
     "3. `route(origin: str, destination: str, profile: str)`: Trazar una ruta entre dos puntos.\n"
     "   - Perfiles: 'driving' (coche), 'cycling' (bici), 'walking' (pie).\n"
     "4. `area(query: str)`: Muestra el contorno/perímetro cerrado de una zona administrativa (distrito, barrio, ciudad, parque).\n\n"
@@ -99,7 +211,770 @@ def normalise_profile(raw_profile: str | None) -> str:
     return PROFILE_ALIASES.get(key, "driving")
 
 
+# --- Trazas ---
+# Spans al estilo OpenTelemetry sin dependencias: la decisión de muestreo se
+# toma en el span raíz de cada petición y, si no se muestrea, los spans hijos
+# se reducen a un objeto vacío. La escritura a disco la hace un hilo aparte.
+
+SPAN_KIND_INTERNAL, SPAN_KIND_SERVER, SPAN_KIND_CLIENT = 1, 2, 3
+
+
+def otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    encoded = []
+    for key, value in attributes.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            typed = {"boolValue": value}
+        elif isinstance(value, int):
+            typed = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed = {"doubleValue": value}
+        else:
+            typed = {"stringValue": str(value)}
+        encoded.append({"key": key, "value": typed})
+    return encoded
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start_ns", "attributes", "events", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: str = "", kind: int = SPAN_KIND_INTERNAL) -> None:
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.attributes: Dict[str, Any] = {}
+        self.events: List[Dict[str, Any]] = []
+        self.error: str | None = None
+
+    def set_attributes(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def add_event(self, name: str, **attributes: Any) -> None:
+        self.events.append(
+            {"timeUnixNano": str(time.time_ns()), "name": name, "attributes": otlp_attributes(attributes)}
+        )
+
+    def record_error(self, exc: BaseException) -> None:
+        self.error = str(exc)
+        self.add_event("exception", **{"exception.type": type(exc).__name__, "exception.message": str(exc)})
+
+    def end(self) -> None:
+        TRACE_EXPORTER.submit({
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(time.time_ns()),
+            "attributes": otlp_attributes(self.attributes),
+            "events": self.events,
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        })
+
+
+class NoopSpan:
+    """Sustituto de Span cuando la petición no está muestreada."""
+
+    trace_id = ""
+
+    def set_attributes(self, **attributes: Any) -> None:
+        pass
+
+    def add_event(self, name: str, **attributes: Any) -> None:
+        pass
+
+    def record_error(self, exc: BaseException) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+_CURRENT_SPAN: contextvars.ContextVar[Span | NoopSpan] = contextvars.ContextVar("current_span", default=NOOP_SPAN)
+
+
+class TraceExporter:
+    """Escribe spans terminados en TRACE_EXPORT_PATH desde un hilo en segundo plano."""
+
+    def __init__(self, path: str, max_queue: int, max_bytes: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.dropped = 0
+        self.exported = 0
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_queue)
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def submit(self, span: Dict[str, Any]) -> None:
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            # Nunca bloqueamos una petición por culpa de las trazas
+            self.dropped += 1
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            spans = [self._queue.get()]
+            while len(spans) < 512:
+                try:
+                    spans.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            line = json.dumps({
+                "resourceSpans": [{
+                    "resource": {"attributes": otlp_attributes({"service.name": "mapa-inteligente", "process.pid": os.getpid()})},
+                    "scopeSpans": [{"scope": {"name": "app"}, "spans": spans}],
+                }]
+            }, ensure_ascii=False)
+            try:
+                self._rotate()
+                with open(self.path, "a", encoding="utf-8") as handle:
+                    handle.write(line + "\n")
+                self.exported += len(spans)
+            except OSError:
+                self.dropped += len(spans)
+
+    def _rotate(self) -> None:
+        # Si dos procesos rotan a la vez uno puede pisar la copia del otro:
+        # se pierde un lote antiguo, pero el fichero nunca crece sin límite.
+        if self.max_bytes <= 0:
+            return
+        try:
+            if os.path.getsize(self.path) < self.max_bytes:
+                return
+        except FileNotFoundError:
+            return
+        os.replace(self.path, self.path + ".1")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"sample_rate": TRACE_SAMPLE_RATE, "exported": self.exported, "dropped": self.dropped}
+
+
+TRACE_EXPORTER = TraceExporter(TRACE_EXPORT_PATH, TRACE_QUEUE_SIZE, TRACE_MAX_BYTES)
+
+
+def current_span() -> Span | NoopSpan:
+    return _CURRENT_SPAN.get()
+
+
+def start_root_span(name: str, **attributes: Any) -> Tuple[Span | NoopSpan, contextvars.Token]:
+    """Abre el span raíz de una petición, decidiendo aquí si se muestrea."""
+    if TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE:
+        span: Span | NoopSpan = Span(name, os.urandom(16).hex(), kind=SPAN_KIND_SERVER)
+        span.set_attributes(**attributes)
+    else:
+        span = NOOP_SPAN
+    return span, _CURRENT_SPAN.set(span)
+
+
+def finish_root_span(span: Span | NoopSpan, token: contextvars.Token) -> None:
+    _CURRENT_SPAN.reset(token)
+    span.end()
+
+
+@contextmanager
+def trace_span(name: str, kind: int = SPAN_KIND_INTERNAL, **attributes: Any) -> Iterator[Span | NoopSpan]:
+    parent = _CURRENT_SPAN.get()
+    if parent is NOOP_SPAN:
+        yield NOOP_SPAN
+        return
+    span = Span(name, parent.trace_id, parent.span_id, kind)
+    span.set_attributes(**attributes)
+    token = _CURRENT_SPAN.set(span)
+    try:
+        yield span
+    except BaseException as exc:
+        span.record_error(exc)
+        raise
+    finally:
+        _CURRENT_SPAN.reset(token)
+        span.end()
+
+
+def traced_request(
+    method: str, url: str, service: str, session: requests.Session | None = None, **kwargs: Any
+) -> requests.Response:
+    """requests.request dentro de un span de cliente HTTP (sin registrar la query, que puede llevar claves)."""
+    with trace_span(f"HTTP {method} {service}", kind=SPAN_KIND_CLIENT, **{
+        "http.method": method,
+        "http.url": url,
+        "peer.service": service,
+    }) as span:
+        response = (session or requests).request(method, url, **kwargs)
+        span.set_attributes(**{"http.status_code": response.status_code})
+        return response
+
+
+# --- Plazos por petición ---
+# Una petición admitida lleva un plazo absoluto; cada llamada externa recorta su
+# timeout a lo que queda y, si ya no queda nada, ni siquiera se lanza.
+
+_DEADLINE: contextvars.ContextVar[float | None] = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(requests_exceptions.Timeout):
+    """Se agotó el plazo de la petición antes de llamar a un servicio externo."""
+
+
+@contextmanager
+def request_deadline(seconds: float) -> Iterator[None]:
+    token = _DEADLINE.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _DEADLINE.reset(token)
+
+
+def remaining_time() -> float | None:
+    deadline = _DEADLINE.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def upstream_timeout(default: float) -> float:
+    remaining = remaining_time()
+    if remaining is None:
+        return default
+    if remaining <= 0.1:
+        raise DeadlineExceeded("Se agotó el tiempo máximo de la consulta.")
+    return min(default, remaining)
+
+
+class TTLCache:
+    """Caché LRU en memoria con caducidad por entrada, segura entre hilos."""
+
+    def __init__(self, max_entries: int, ttl: float) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Any, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def peek(self, key: Any) -> bool:
+        """Indica si la clave está vigente sin contar como acceso."""
+        with self._lock:
+            entry = self._data.get(key)
+        return entry is not None and entry[0] >= time.monotonic()
+
+    def pop(self, key: Any) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, None)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+
+class MemorySharedStore:
+    """
+    Almacén compartido mínimo: clave/valor con caducidad, contadores y reserva de
+    turnos para espaciar peticiones. Esta versión en memoria solo se comparte
+    entre hilos; sirve de sustituto local de SQLite o Redis.
+    """
+
+    def __init__(self) -> None:
+        self._values: Dict[str, Tuple[float, bytes]] = {}
+        self._counters: Dict[str, int] = {}
+        self._slots: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None or entry[0] < time.time():
+                self._values.pop(key, None)
+                return None
+            return entry[1]
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        with self._lock:
+            self._values[key] = (time.time() + ttl, value)
+
+    def incr_many(self, amounts: Dict[str, int]) -> None:
+        with self._lock:
+            for key, amount in amounts.items():
+                self._counters[key] = self._counters.get(key, 0) + amount
+
+    def counters(self, prefix: str) -> Dict[str, int]:
+        with self._lock:
+            return {k: v for k, v in self._counters.items() if k.startswith(prefix)}
+
+    def reserve_slot(self, key: str, interval: float, max_wait: float = math.inf) -> float:
+        """
+        Reserva el siguiente turno libre y devuelve cuántos segundos esperar. Si
+        la espera supera `max_wait` no reserva nada (y devuelve esa espera).
+        """
+        with self._lock:
+            now = time.time()
+            start = max(now, self._slots.get(key, 0.0))
+            if start - now <= max_wait:
+                self._slots[key] = start + interval
+            return start - now
+
+    def acquire_token(self, key: str, interval: float, burst: int) -> float:
+        """
+        Cubo de fichas (GCRA): una ficha cada `interval` segundos y hasta `burst`
+        seguidas. Devuelve 0 si se concede o los segundos hasta la siguiente.
+        """
+        with self._lock:
+            now = time.time()
+            next_at = max(now, self._slots.get(key, 0.0)) + interval
+            allowed_at = next_at - burst * interval
+            if allowed_at > now:
+                return allowed_at - now
+            self._slots[key] = next_at
+            return 0.0
+
+
+class SQLiteSharedStore(MemorySharedStore):
+    """Almacén compartido en un fichero SQLite en modo WAL, válido entre procesos del mismo host."""
+
+    def __init__(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS slots (key TEXT PRIMARY KEY, next_at REAL NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Una conexión por hilo; las transacciones se abren explícitamente
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> bytes | None:
+        row = self._connect().execute(
+            "SELECT value FROM cache WHERE key = ? AND expires >= ?", (key, time.time())
+        ).fetchone()
+        return bytes(row[0]) if row else None
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)", (key, value, now + ttl)
+        )
+        self._writes += 1
+        if self._writes % 200 == 0:
+            conn.execute("DELETE FROM cache WHERE expires < ?", (now,))
+
+    def incr_many(self, amounts: Dict[str, int]) -> None:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO counters (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+                list(amounts.items()),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def counters(self, prefix: str) -> Dict[str, int]:
+        rows = self._connect().execute(
+            "SELECT key, value FROM counters WHERE key LIKE ?", (prefix.replace("%", "") + "%",)
+        ).fetchall()
+        return dict(rows)
+
+    def reserve_slot(self, key: str, interval: float, max_wait: float = math.inf) -> float:
+        conn = self._connect()
+        # BEGIN IMMEDIATE toma el bloqueo de escritura: dos procesos no pueden
+        # reservar el mismo turno.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute("SELECT next_at FROM slots WHERE key = ?", (key,)).fetchone()
+            start = max(now, row[0] if row else 0.0)
+            if start - now <= max_wait:
+                conn.execute("INSERT OR REPLACE INTO slots (key, next_at) VALUES (?, ?)", (key, start + interval))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return start - now
+
+    def acquire_token(self, key: str, interval: float, burst: int) -> float:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute("SELECT next_at FROM slots WHERE key = ?", (key,)).fetchone()
+            next_at = max(now, row[0] if row else 0.0) + interval
+            allowed_at = next_at - burst * interval
+            if allowed_at <= now:
+                conn.execute("INSERT OR REPLACE INTO slots (key, next_at) VALUES (?, ?)", (key, next_at))
+            self._writes += 1
+            if self._writes % 200 == 0:
+                # Un turno ya pasado equivale a no tener fila: hay una por cliente
+                conn.execute("DELETE FROM slots WHERE next_at < ?", (now,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return max(allowed_at - now, 0.0)
+
+
+class RedisSharedStore(MemorySharedStore):
+    """Almacén compartido en un servidor compatible con Redis (Redis, Valkey, KeyDB...)."""
+
+    _RESERVE_SLOT_SCRIPT = """
+local now = tonumber(ARGV[1])
+local start = math.max(now, tonumber(redis.call('GET', KEYS[1]) or '0'))
+if start - now > tonumber(ARGV[3]) then
+  return tostring(start - now)
+end
+local next_at = start + tonumber(ARGV[2])
+redis.call('SET', KEYS[1], tostring(next_at), 'PX', math.ceil((next_at - now) * 1000) + 1000)
+return tostring(start - now)
+"""
+
+    _ACQUIRE_TOKEN_SCRIPT = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local next_at = math.max(now, tonumber(redis.call('GET', KEYS[1]) or '0')) + interval
+local allowed_at = next_at - tonumber(ARGV[3]) * interval
+if allowed_at > now then
+  return tostring(allowed_at - now)
+end
+redis.call('SET', KEYS[1], tostring(next_at), 'PX', math.ceil((next_at - now) * 1000) + 1000)
+return '0'
+"""
+
+    def __init__(self, url: str) -> None:
+        try:
+            import redis
+        except ImportError as exc:
+            raise RuntimeError("SHARED_CACHE_URL apunta a Redis pero el paquete 'redis' no está instalado.") from exc
+        self._client = redis.Redis.from_url(url)
+        self._reserve_slot = self._client.register_script(self._RESERVE_SLOT_SCRIPT)
+        self._acquire_token = self._client.register_script(self._ACQUIRE_TOKEN_SCRIPT)
+
+    def get(self, key: str) -> bytes | None:
+        return self._client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._client.set(key, value, px=int(ttl * 1000))
+
+    def incr_many(self, amounts: Dict[str, int]) -> None:
+        pipeline = self._client.pipeline(transaction=False)
+        for key, amount in amounts.items():
+            pipeline.hincrby("counters", key, amount)
+        pipeline.execute()
+
+    def counters(self, prefix: str) -> Dict[str, int]:
+        return {
+            key.decode(): int(value)
+            for key, value in self._client.hgetall("counters").items()
+            if key.decode().startswith(prefix)
+        }
+
+    def reserve_slot(self, key: str, interval: float, max_wait: float = math.inf) -> float:
+        # Lua no entiende "inf" como número: un año basta como "sin límite"
+        return float(self._reserve_slot(keys=[key], args=[time.time(), interval, min(max_wait, 31536000.0)]))
+
+    def acquire_token(self, key: str, interval: float, burst: int) -> float:
+        return float(self._acquire_token(keys=[key], args=[time.time(), interval, burst]))
+
+
+def create_shared_store(url: str) -> MemorySharedStore:
+    if url.startswith("sqlite:///"):
+        return SQLiteSharedStore(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisSharedStore(url)
+    if url in ("", "memory://"):
+        return MemorySharedStore()
+    raise RuntimeError(f"SHARED_CACHE_URL no soportada: {url}")
+
+
+SHARED_STORE = create_shared_store(SHARED_CACHE_URL)
+
+
+class SharedCache:
+    """
+    Caché con la misma interfaz que TTLCache respaldada por SHARED_STORE, con
+    una caché cercana en memoria por proceso. Los aciertos y fallos se suman en
+    contadores compartidos, así que las tasas reflejan a todos los procesos.
+    """
+
+    def __init__(self, namespace: str, max_entries: int, ttl: float) -> None:
+        self.namespace = namespace
+        self.ttl = ttl
+        self._near = TTLCache(max_entries, min(ttl, NEAR_CACHE_TTL))
+        self._counts: Dict[str, int] = {}
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _store_key(self, key: Any) -> str:
+        return f"{self.namespace}:{json.dumps(key, ensure_ascii=False)}"
+
+    def get(self, key: Any) -> Any:
+        with trace_span("cache.get", **{"cache.namespace": self.namespace}) as span:
+            value = self._near.get(key)
+            tier = "near"
+            if value is None:
+                raw = SHARED_STORE.get(self._store_key(key))
+                tier = "shared"
+                if raw is not None:
+                    value = json.loads(raw)
+                    self._near.set(key, value)
+            span.set_attributes(**{"cache.hit": value is not None, "cache.tier": tier})
+        self._count("hits" if value is not None else "misses")
+        return value
+
+    def peek(self, key: Any) -> bool:
+        return self._near.peek(key) or SHARED_STORE.get(self._store_key(key)) is not None
+
+    def set(self, key: Any, value: Any) -> None:
+        self._near.set(key, value)
+        SHARED_STORE.set(self._store_key(key), json.dumps(value, ensure_ascii=False).encode(), self.ttl)
+
+    def _count(self, outcome: str) -> None:
+        # Acumulamos localmente y volcamos como mucho una vez por segundo para no
+        # convertir cada lectura en una escritura compartida.
+        with self._lock:
+            self._counts[outcome] = self._counts.get(outcome, 0) + 1
+            if time.monotonic() - self._last_flush < 1.0:
+                return
+            counts, self._counts = self._counts, {}
+            self._last_flush = time.monotonic()
+        SHARED_STORE.incr_many({f"cache:{self.namespace}:{k}": v for k, v in counts.items()})
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = dict(self._counts)
+        shared = SHARED_STORE.counters(f"cache:{self.namespace}:")
+        hits = shared.get(f"cache:{self.namespace}:hits", 0) + pending.get("hits", 0)
+        misses = shared.get(f"cache:{self.namespace}:misses", 0) + pending.get("misses", 0)
+        lookups = hits + misses
+        return {
+            "near": self._near.stats(),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 3) if lookups else None,
+        }
+
+
+class UpstreamBusy(RuntimeError):
+    """La cola de turnos de un servicio externo es más larga de lo que aceptamos esperar."""
+
+    def __init__(self, service: str, retry_after: float) -> None:
+        super().__init__(f"El servicio {service} está saturado ahora mismo.")
+        self.retry_after = retry_after
+
+
+def pace_upstream(name: str, interval: float, max_wait: float = math.inf) -> None:
+    """
+    Espera el turno reservado en SHARED_STORE para respetar el ritmo de un
+    servicio externo. No reserva turno si habría que esperar más de `max_wait`
+    o más de lo que le queda al plazo de la petición.
+    """
+    if interval <= 0:
+        return
+    remaining = remaining_time()
+    # Tras la espera tiene que quedar tiempo para la propia petición
+    limit = max_wait if remaining is None else min(max_wait, remaining - 1.0)
+    if limit < 0:
+        raise DeadlineExceeded("Se agotó el tiempo máximo de la consulta.")
+    wait = SHARED_STORE.reserve_slot(f"pace:{name}", interval, limit)
+    if wait > limit:
+        if wait <= max_wait:
+            raise DeadlineExceeded("Se agotó el tiempo máximo de la consulta.")
+        raise UpstreamBusy(name, wait)
+    if wait > 0:
+        time.sleep(wait)
+
+
+def nominatim_get(url: str, params: Dict[str, Any], stream: bool = False) -> requests.Response:
+    with trace_span("pace.nominatim"):
+        pace_upstream("nominatim", NOMINATIM_MIN_INTERVAL, NOMINATIM_MAX_WAIT)
+    return traced_request(
+        "GET",
+        url,
+        "nominatim",
+        params=params,
+        timeout=upstream_timeout(15),
+        headers={"User-Agent": NOMINATIM_USER_AGENT},
+        stream=stream,
+    )
+
+
+# --- Normalización de consultas ---
+# Cada consulta se limpia en una sola pasada con expresiones precompiladas y
+# produce dos cosas: el texto que se envía a Nominatim y una clave canónica de
+# ese texto (sin tildes, en minúsculas y con espacios y comas uniformes) con la
+# que las cachés reconocen como la misma consulta "Museo del Prado, Madrid" y
+# "museo del prado ,madrid". Los artículos y partículas de los nombres se
+# conservan: "La Paz" y "Paz" o "Rue de Buci" y "Rue Buci" son lugares distintos.
+
+class NormalizedQuery(NamedTuple):
+    raw: str
+    display: str
+    key: str
+
+
+# Comandos y conectores al inicio ("Localiza el Museo del Prado", "desde Sol")
+# y el "en" de "Museo del Prado en Madrid"; el resto de espacios se colapsa en
+# la misma pasada. Un artículo solo se quita tras un comando: "El Salvador",
+# "La Paz" o "Las Vegas" lo llevan en el nombre.
+_QUERY_NOISE = re.compile(
+    r"(?P<lead>^\s*(?:(?:(?:mira|busca|localiza|enseñame|marca)\s+(?:(?:el|la|los|las|un|una)\s+)?"
+    r"|(?:un|una|en|desde|hacia)\s+)(?=\S))?)"
+    r"|(?P<en>\s+en\s+)|(?P<trail>\s+$)|(?P<space>\s+)",
+    re.IGNORECASE,
+)
+_ROMAN_NUMERALS = {
+    numeral: value
+    for value, numeral in enumerate(
+        "i ii iii iv v vi vii viii ix x xi xii xiii xiv xv xvi xvii xviii xix xx".split(), start=1
+    )
+}
+_ARRONDISSEMENT_NUMBER = r"(?P<{name}>\d{{1,2}}|[ivx]{{1,5}})"
+_ARRONDISSEMENT_ORDINAL = r"\s*(?:º|ª|o|er|e|ème|eme|è)"
+_ARRONDISSEMENT_WORD = r"(?:distrito|arrondissement|arr\.?)"
+# "Distrito 5 de París", "distrito IV de Paris", "5e arrondissement de Paris",
+# "París 5º distrito", "Paris 5e", "Paris XVIe arrondissement". Tras "Paris",
+# un número suelto (una dirección) no cuenta, y un numeral romano necesita la
+# palabra "arrondissement"/"distrito" ("Paris vie" no es el distrito VI).
+_PARIS_ARRONDISSEMENT = re.compile(
+    r"\b(?:" + _ARRONDISSEMENT_WORD + r"\s+" + _ARRONDISSEMENT_NUMBER.format(name="a") + f"(?:{_ARRONDISSEMENT_ORDINAL})?"
+    + r"|" + _ARRONDISSEMENT_NUMBER.format(name="b") + f"(?:{_ARRONDISSEMENT_ORDINAL})?" + r"\s+" + _ARRONDISSEMENT_WORD + r")"
+    r"\s*,?\s*(?:(?:de|of|du)\s+)?par[ií]s\b"
+    r"|\bpar[ií]s\s*,?\s*(?:(?P<c>\d{1,2})"
+    + f"(?:{_ARRONDISSEMENT_ORDINAL}(?:\\s+{_ARRONDISSEMENT_WORD})?|\\s+{_ARRONDISSEMENT_WORD})"
+    + r"|(?P<d>[ivx]{1,5})" + f"(?:{_ARRONDISSEMENT_ORDINAL})?\\s+{_ARRONDISSEMENT_WORD})" + r"(?!\w)",
+    re.IGNORECASE,
+)
+_KEY_COMMA = re.compile(r"\s*,\s*")
+
+
+def paris_arrondissement(match: re.Match) -> str:
+    token = next(match.group(name) for name in "abcd" if match.group(name)).lower()
+    number = int(token) if token.isdigit() else _ROMAN_NUMERALS.get(token, 0)
+    if not 1 <= number <= 20:
+        return match.group(0)
+    return f"Paris {number}{'er' if number == 1 else 'e'} Arrondissement"
+
+
+def normalize_place_names(text: str) -> str:
+    """Reescribe los distritos de París con su nombre oficial ("Distrito 5 de París" -> "Paris 5e Arrondissement")."""
+    return _PARIS_ARRONDISSEMENT.sub(paris_arrondissement, text)
+
+
+def fold_text(text: str) -> str:
+    """Minúsculas y sin marcas diacríticas ("París" -> "paris")."""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def query_key(text: str) -> str:
+    """Clave de caché del texto tal cual se envía a Nominatim."""
+    return _KEY_COMMA.sub(", ", " ".join(fold_text(text).split())).strip(" ,")
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize_query(query: str) -> NormalizedQuery:
+    display = _QUERY_NOISE.sub(
+        lambda m: "" if m.group("lead") is not None or m.group("trail") is not None else " ", query or ""
+    )
+    display = normalize_place_names(display)
+    return NormalizedQuery(query, display, query_key(display))
+
+
+def normalize_queries(queries: Iterable[str]) -> Dict[str, NormalizedQuery]:
+    """Normaliza un lote de consultas (p.ej. todos los campos de un plan) de una vez."""
+    return {query: normalize_query(query) for query in queries if query}
+
+
+def clean_search_query(query: str) -> str:
+    """Texto limpio que se envía a Nominatim (ver `normalize_query`)."""
+    return normalize_query(query).display if query else ""
+
+
+GEOCODE_CACHE = SharedCache("geocode", GEOCODE_CACHE_SIZE, GEOCODE_CACHE_TTL)
+
+
+def geocode_cache_key(query: str, include_polygon: bool = False, viewbox: str | None = None) -> Tuple[str, bool, str]:
+    # La clave es la del texto que se va a enviar: la limpieza (clean_search_query)
+    # ya la ha hecho quien llama, y el reintento con el texto original es otra consulta.
+    return (query_key(query), bool(include_polygon), viewbox or "")
+
+
 def geocode_place(query: str, include_polygon: bool = False, viewbox: str | None = None) -> Dict[str, Any]:
+    key = geocode_cache_key(query, include_polygon, viewbox)
+    place = attach_stored_geometry(GEOCODE_CACHE.get(key))
+    ready = place is not None
+    if place is None:
+        # Si hay una precarga especulativa en curso para esta clave, la esperamos
+        # en lugar de lanzar una segunda petición a Nominatim.
+        place = GEOCODE_PREFETCHER.wait_for(key) or attach_stored_geometry(GEOCODE_CACHE.get(key))
+    if place is None:
+        place = GEOCODE_PREFETCHER.claim_extension(key)
+        if place is not None:
+            place = dict(place, query=query)
+            cache_place(key, place)
+    if place is None:
+        place = fetch_place(query, include_polygon=include_polygon, viewbox=viewbox)
+        cache_place(key, place)
+    GEOCODE_PREFETCHER.record_use(key, ready=ready)
+    return dict(place)
+
+
+def fetch_place(query: str, include_polygon: bool = False, viewbox: str | None = None) -> Dict[str, Any]:
     # Si pedimos polígono, pedimos varios resultados para poder elegir el que tenga geometría real
     limit = 5 if include_polygon else 1
     params = {
@@ -116,37 +991,620 @@ def geocode_place(query: str, include_polygon: bool = False, viewbox: str | None
         # No forzamos bounded=1 para permitir encontrar fuera si no hay nada en el viewbox,
         # pero viewbox da prioridad a lo que esté dentro.
 
-    response = requests.get(
-        NOMINATIM_ENDPOINT,
-        params=params,
-        timeout=15,
-        headers={"User-Agent": NOMINATIM_USER_AGENT},
-    )
-    response.raise_for_status()
-    data = response.json()
-    if not data:
-        raise ValueError(f"No se encontraron resultados para '{query}'.")
-
-    # Si buscamos un área o trazado, priorizamos el resultado que tenga geometría (Polygon/LineString)
-    if include_polygon:
-        best_match = None
-        for res in data:
-            geojson = res.get("geojson", {})
-            if geojson.get("type") in ["Polygon", "MultiPolygon", "LineString"]:
-                best_match = res
-                break
-        result = best_match or data[0]
+    if include_polygon and GEOMETRY_FETCH_MODE == "lazy":
+        del params["polygon_geojson"]
+        result = fetch_best_geometry_candidate(params)
+    elif include_polygon:
+        result = fetch_best_polygon_result(params)
     else:
-        result = data[0]
+        response = nominatim_get(NOMINATIM_ENDPOINT, params)
+        response.raise_for_status()
+        data = response.json()
+        result = data[0] if data else None
+    if not result:
+        raise ValueError(f"No se encontraron resultados para '{query}'.")
 
-    return {
+    place = {
         "query": query,
         "displayName": result.get("display_name"),
         "lat": float(result["lat"]),
         "lon": float(result["lon"]),
         "geojson": result.get("geojson"),
         "bounding_box": result.get("boundingbox"),
+        "osm_type": result.get("osm_type"),
+        "osm_id": result.get("osm_id"),
+    }
+    stats = geometry_stats(place["geojson"])
+    if stats:
+        place["geometry_stats"] = stats
+    if include_polygon and not place["geojson"] and place["osm_type"] in GEOMETRY_OSM_TYPES:
+        place["geometry_url"] = f"/api/geometry/{place['osm_type']}/{place['osm_id']}"
+    return place
+
+
+POLYGON_GEOJSON_TYPES = (b"Polygon", b"MultiPolygon", b"LineString")
+_GEOJSON_TYPE = re.compile(rb'"geojson"\s*:\s*\{\s*"type"\s*:\s*"(\w+)"')
+# Las secuencias de arrays hoja (pares de coordenadas) no cambian la
+# profundidad, así que se saltan de una vez en lugar de carácter a carácter.
+_JSON_STRUCTURAL = re.compile(rb'(?:\[[^\[\]{}"]*\][,\s]*){2,}|[\[\]{}"]')
+_JSON_STRING_TAIL = re.compile(rb'(?:[^"\\]|\\.)*"', re.DOTALL)
+
+
+def iter_json_array_items(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Recorre un array JSON recibido por trozos y devuelve cada objeto de primer
+    nivel como bytes sin decodificar. Solo se mantiene en memoria el elemento
+    que se está leyendo, nunca la respuesta completa.
+    """
+    buffer = bytearray()
+    pos = 0
+    depth = 0
+    start = -1
+    for chunk in chunks:
+        if not chunk:
+            continue
+        buffer += chunk
+        while True:
+            match = _JSON_STRUCTURAL.search(buffer, pos)
+            if match is None:
+                pos = len(buffer)
+                break
+            char = match.group()
+            if len(char) > 1:
+                pos = match.end()
+                continue
+            if char == b'"':
+                tail = _JSON_STRING_TAIL.match(buffer, match.end())
+                if tail is None:
+                    # Cadena cortada entre dos trozos: esperamos al siguiente
+                    pos = match.start()
+                    break
+                pos = tail.end()
+                continue
+            pos = match.end()
+            if char in b"[{":
+                depth += 1
+                if depth == 2:
+                    start = match.start()
+                continue
+            depth -= 1
+            if depth == 1 and start >= 0:
+                yield bytes(buffer[start:pos])
+                del buffer[:pos]
+                pos = 0
+                start = -1
+            elif depth == 0:
+                return
+        if start < 0:
+            # Fuera de un elemento no hace falta conservar lo ya analizado
+            del buffer[:pos]
+            pos = 0
+
+
+def geojson_type_of(raw_item: bytes) -> bytes | None:
+    match = _GEOJSON_TYPE.search(raw_item)
+    if match:
+        return match.group(1)
+    if b'"geojson"' not in raw_item:
+        return None
+    geojson = json.loads(raw_item).get("geojson") or {}
+    return str(geojson.get("type", "")).encode() or None
+
+
+def fetch_best_polygon_result(params: Dict[str, Any]) -> Dict[str, Any] | None:
+    """
+    Pide a Nominatim varios candidatos con geometría y se queda con el primero
+    que sea un área o trazado (o con el primero si ninguno lo es). La respuesta
+    se analiza en streaming: los candidatos descartados nunca llegan a
+    convertirse en objetos Python.
+    """
+    first_item: bytes | None = None
+    with nominatim_get(NOMINATIM_ENDPOINT, params, stream=True) as response:
+        response.raise_for_status()
+        for raw_item in iter_json_array_items(response.iter_content(chunk_size=64 * 1024)):
+            if geojson_type_of(raw_item) in POLYGON_GEOJSON_TYPES:
+                # Cortamos la descarga: el resto de candidatos ya no interesa
+                return json.loads(raw_item)
+            if first_item is None:
+                first_item = raw_item
+    return json.loads(first_item) if first_item is not None else None
+
+
+# Mismo radio y fórmula que L.GeometryUtil.geodesicArea, para que las áreas
+# importadas y las dibujadas en el navegador sean comparables.
+EARTH_RADIUS_M = 6378137.0
+
+
+def ring_array(ring: List[List[float]]) -> np.ndarray:
+    if not ring:
+        # Anillo vacío en un polígono mal formado: se trata como degenerado
+        return np.empty((0, 2), dtype=np.float64)
+    coords = np.asarray(ring, dtype=np.float64)[:, :2]
+    if len(coords) and not np.array_equal(coords[0], coords[-1]):
+        coords = np.vstack([coords, coords[:1]])
+    return coords
+
+
+def ring_geodesic_area(coords: np.ndarray) -> float:
+    lon = np.radians(coords[:, 0])
+    sin_lat = np.sin(np.radians(coords[:, 1]))
+    area = np.sum((lon[1:] - lon[:-1]) * (2.0 + sin_lat[:-1] + sin_lat[1:]))
+    return abs(float(area)) * EARTH_RADIUS_M * EARTH_RADIUS_M / 2.0
+
+
+def ring_length(coords: np.ndarray) -> float:
+    lon = np.radians(coords[:, 0])
+    lat = np.radians(coords[:, 1])
+    a = (
+        np.sin((lat[1:] - lat[:-1]) / 2.0) ** 2
+        + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin((lon[1:] - lon[:-1]) / 2.0) ** 2
+    )
+    return float(np.sum(2.0 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))))
+
+
+def ring_planar_moments(coords: np.ndarray) -> Tuple[float, float, float]:
+    """Área con signo y momentos (fórmula del polígono) en grados, para el centroide."""
+    x0, y0 = coords[:-1, 0], coords[:-1, 1]
+    x1, y1 = coords[1:, 0], coords[1:, 1]
+    cross = x0 * y1 - x1 * y0
+    return (
+        float(np.sum(cross)) / 2.0,
+        float(np.sum((x0 + x1) * cross)) / 6.0,
+        float(np.sum((y0 + y1) * cross)) / 6.0,
+    )
+
+
+def geometry_stats(geojson: Dict[str, Any] | None) -> Dict[str, Any] | None:
+    """
+    Área geodésica (descontando huecos), perímetro, centroide y bbox de un
+    Polygon o MultiPolygon GeoJSON. Devuelve None para otros tipos.
+
+    Al contrario que las coordenadas GeoJSON, `centroid` va como [lat, lon]
+    (lo que espera Leaflet) y `bbox` como [sur, norte, oeste, este].
+    """
+    if not geojson or geojson.get("type") not in ("Polygon", "MultiPolygon"):
+        return None
+    polygons = geojson["coordinates"] if geojson["type"] == "MultiPolygon" else [geojson["coordinates"]]
+
+    area = perimeter = 0.0
+    moment_area = moment_x = moment_y = 0.0
+    bounds = [np.inf, -np.inf, np.inf, -np.inf]
+    for polygon in polygons:
+        for position, ring in enumerate(polygon):
+            coords = ring_array(ring)
+            if len(coords) < 4:
+                continue
+            ring_area = ring_geodesic_area(coords)
+            signed, mx, my = ring_planar_moments(coords)
+            # El anillo exterior suma y los huecos restan, sea cual sea su orientación
+            sign = 1.0 if position == 0 else -1.0
+            area += sign * ring_area
+            if signed:
+                factor = sign * abs(signed) / signed
+                moment_area += factor * signed
+                moment_x += factor * mx
+                moment_y += factor * my
+            perimeter += ring_length(coords)
+            if position == 0:
+                bounds = [
+                    min(bounds[0], float(coords[:, 1].min())),
+                    max(bounds[1], float(coords[:, 1].max())),
+                    min(bounds[2], float(coords[:, 0].min())),
+                    max(bounds[3], float(coords[:, 0].max())),
+                ]
+
+    if not np.isfinite(bounds[0]):
+        return None
+    if moment_area:
+        centroid = [moment_y / moment_area, moment_x / moment_area]
+    else:
+        centroid = [(bounds[0] + bounds[1]) / 2.0, (bounds[2] + bounds[3]) / 2.0]
+    return {
+        "area_m2": round(area, 1),
+        "perimeter_m": round(perimeter, 1),
+        # [lat, lon]
+        "centroid": [round(value, 7) for value in centroid],
+        # Mismo orden que el boundingbox de Nominatim: [sur, norte, oeste, este]
+        "bbox": [round(value, 7) for value in bounds],
     }
+
+
+GEOMETRY_OSM_TYPES = ("way", "relation")
+OSM_TYPE_CODES = {"node": "N", "way": "W", "relation": "R"}
+
+
+def fetch_best_geometry_candidate(params: Dict[str, Any]) -> Dict[str, Any] | None:
+    """
+    Primera fase del modo "lazy": búsqueda sin polígonos. Preferimos el primer
+    candidato que sea una vía o relación OSM, que son los que tienen trazado o
+    contorno; su geometría se pide después por id a /api/geometry.
+    """
+    response = nominatim_get(NOMINATIM_ENDPOINT, params)
+    response.raise_for_status()
+    data = response.json()
+    if not data:
+        return None
+    return next((res for res in data if res.get("osm_type") in GEOMETRY_OSM_TYPES), data[0])
+
+
+# Solo cuerpos simplificados y en el propio proceso: la resolución completa se
+# sirve siempre desde GEOMETRY_STORE, que ya es compartido.
+SIMPLIFIED_GEOMETRY_CACHE = TTLCache(GEOMETRY_CACHE_SIZE * 4, GEOMETRY_CACHE_TTL)
+
+
+GEOMETRY_TYPE_CODES = {"LineString": 1, "MultiLineString": 2, "Polygon": 3, "MultiPolygon": 4}
+GEOMETRY_TYPE_NAMES = {code: name for name, code in GEOMETRY_TYPE_CODES.items()}
+GEOMETRY_RECORD_HEADER = struct.Struct("<4sB3xIII")
+GEOMETRY_RECORD_MAGIC = b"GEO1"
+# Coordenadas en enteros de 1e-7 grados, la misma precisión con la que las guarda OSM
+COORD_SCALE = 1e7
+
+
+class GeometryRecord(NamedTuple):
+    geom_type: str
+    part_offsets: np.ndarray
+    ring_offsets: np.ndarray
+    coords: np.ndarray
+    raw: memoryview
+
+
+def geojson_parts(geojson: Dict[str, Any]) -> List[List[List[List[float]]]]:
+    """Normaliza cualquier geometría lineal o poligonal a partes -> anillos -> coordenadas."""
+    coordinates = geojson["coordinates"]
+    geom_type = geojson["type"]
+    if geom_type == "LineString":
+        return [[coordinates]]
+    if geom_type in ("MultiLineString", "Polygon"):
+        return [coordinates]
+    return coordinates
+
+
+def encode_geometry(geojson: Dict[str, Any]) -> bytes:
+    """
+    Serializa una geometría GeoJSON al formato binario "GEO1": cabecera, índices
+    int32 de partes y anillos, y coordenadas [lon, lat] planas en int32.
+    """
+    rings = [ring for part in geojson_parts(geojson) for ring in part if ring]
+    part_offsets = np.cumsum([0] + [len([r for r in part if r]) for part in geojson_parts(geojson)], dtype="<i4")
+    ring_offsets = np.cumsum([0] + [len(ring) for ring in rings], dtype="<i4")
+    if rings:
+        coords = np.concatenate([np.asarray(ring, dtype=np.float64)[:, :2] for ring in rings])
+    else:
+        coords = np.empty((0, 2))
+    coords = np.round(coords * COORD_SCALE).astype("<i4")
+    header = GEOMETRY_RECORD_HEADER.pack(
+        GEOMETRY_RECORD_MAGIC,
+        GEOMETRY_TYPE_CODES[geojson["type"]],
+        len(part_offsets) - 1,
+        len(ring_offsets) - 1,
+        len(coords),
+    )
+    return header + part_offsets.tobytes() + ring_offsets.tobytes() + coords.tobytes()
+
+
+def decode_geometry(buffer: memoryview) -> GeometryRecord:
+    """Vistas NumPy sobre un registro "GEO1", sin copiar las coordenadas."""
+    magic, type_code, n_parts, n_rings, n_coords = GEOMETRY_RECORD_HEADER.unpack_from(buffer)
+    if magic != GEOMETRY_RECORD_MAGIC:
+        raise ValueError("Registro de geometría corrupto.")
+    offset = GEOMETRY_RECORD_HEADER.size
+    part_offsets = np.frombuffer(buffer, dtype="<i4", count=n_parts + 1, offset=offset)
+    offset += part_offsets.nbytes
+    ring_offsets = np.frombuffer(buffer, dtype="<i4", count=n_rings + 1, offset=offset)
+    offset += ring_offsets.nbytes
+    coords = np.frombuffer(buffer, dtype="<i4", count=n_coords * 2, offset=offset).reshape(-1, 2)
+    length = offset + coords.nbytes
+    return GeometryRecord(GEOMETRY_TYPE_NAMES[type_code], part_offsets, ring_offsets, coords, buffer[:length])
+
+
+def record_to_geojson(record: GeometryRecord, tolerance: float = 0.0) -> Dict[str, Any]:
+    parts = []
+    for p in range(len(record.part_offsets) - 1):
+        rings = []
+        for r in range(record.part_offsets[p], record.part_offsets[p + 1]):
+            ring = record.coords[record.ring_offsets[r]:record.ring_offsets[r + 1]] / COORD_SCALE
+            reduced = simplify_coords(ring, tolerance)
+            if record.geom_type in ("Polygon", "MultiPolygon") and len(reduced) < 4:
+                if r != record.part_offsets[p]:
+                    continue
+                # Nunca dejamos un polígono sin anillo exterior
+                reduced = ring
+            rings.append(reduced.round(7).tolist())
+        parts.append(rings)
+
+    if record.geom_type == "LineString":
+        coordinates: Any = parts[0][0]
+    elif record.geom_type in ("MultiLineString", "Polygon"):
+        coordinates = parts[0]
+    else:
+        coordinates = parts
+    return {"type": record.geom_type, "coordinates": coordinates}
+
+
+class GeometryStore:
+    """
+    Almacén de geometrías por id OSM: un fichero binario de solo anexado que se
+    lee mediante mmap (compartido entre procesos a través de la caché de páginas
+    del sistema) y un índice SQLite con desplazamiento, longitud y metadatos.
+    Sin directorio, guarda los registros binarios en la memoria del proceso.
+
+    Cuando los registros caducados ocupan más de la mitad del fichero se
+    compacta: los vivos se copian a un fichero de la generación siguiente y el
+    índice pasa a apuntar a él. Los procesos que tengan mapeado el anterior lo
+    siguen leyendo sin problema hasta que vuelven a consultar el índice.
+    """
+
+    COMPACT_MIN_BYTES = 1 << 20
+
+    def __init__(self, directory: str | None, ttl: float) -> None:
+        self.ttl = ttl
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._local = threading.local()
+        self._memory = TTLCache(GEOMETRY_CACHE_SIZE, ttl)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS geometries (key TEXT PRIMARY KEY, generation INTEGER NOT NULL DEFAULT 0, "
+                    "offset INTEGER NOT NULL, length INTEGER NOT NULL, meta TEXT NOT NULL, created REAL NOT NULL)"
+                )
+                conn.execute("CREATE TABLE IF NOT EXISTS store_state (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            open(self._data_path(self._generation(self._connect())), "ab").close()
+
+    @property
+    def data_path(self) -> str:
+        return self._data_path(self._generation(self._connect()))
+
+    def _data_path(self, generation: int) -> str:
+        name = "geometries.bin" if generation == 0 else f"geometries.{generation}.bin"
+        return os.path.join(self.directory, name)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                os.path.join(self.directory, "index.sqlite3"), timeout=10, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _generation(conn: sqlite3.Connection) -> int:
+        row = conn.execute("SELECT value FROM store_state WHERE name = 'generation'").fetchone()
+        return row[0] if row else 0
+
+    def _view(self, generation: int, offset: int, length: int) -> memoryview:
+        with self._lock:
+            mm = self._maps.get(generation)
+            if mm is None or offset + length > len(mm):
+                # El fichero ha crecido: mapeamos de nuevo. El mapa anterior sigue
+                # vivo mientras haya vistas NumPy que lo referencien.
+                with open(self._data_path(generation), "rb") as handle:
+                    mm = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+                # Los mapas de generaciones anteriores ya no se van a leer
+                self._maps = {gen: m for gen, m in self._maps.items() if gen > generation}
+                self._maps[generation] = mm
+            return memoryview(mm)[offset:offset + length]
+
+    def get(self, osm_type: str, osm_id: int) -> Tuple[Dict[str, Any], GeometryRecord] | None:
+        key = f"{osm_type}/{osm_id}"
+        if not self.directory:
+            entry = self._memory.get(key)
+            return (entry[0], decode_geometry(memoryview(entry[1]))) if entry else None
+        for attempt in range(2):
+            row = self._connect().execute(
+                "SELECT generation, offset, length, meta FROM geometries WHERE key = ? AND created >= ?",
+                (key, time.time() - self.ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            try:
+                return json.loads(row[3]), decode_geometry(self._view(row[0], row[1], row[2]))
+            except FileNotFoundError:
+                # Otro proceso ha compactado entre la consulta y la apertura
+                if attempt:
+                    raise
+        return None
+
+    def put(self, osm_type: str, osm_id: int, geojson: Dict[str, Any], meta: Dict[str, Any]) -> bool:
+        if geojson.get("type") not in GEOMETRY_TYPE_CODES:
+            return False
+        key = f"{osm_type}/{osm_id}"
+        if not self.directory:
+            if not self._memory.peek(key):
+                self._memory.set(key, (meta, encode_geometry(geojson)))
+            return True
+        conn = self._connect()
+        # El bloqueo de escritura del índice serializa también los anexados
+        # al fichero binario entre procesos.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            live = conn.execute(
+                "SELECT 1 FROM geometries WHERE key = ? AND created >= ?", (key, now - self.ttl)
+            ).fetchone()
+            if live is None:
+                # El mismo objeto llega con varias consultas distintas: solo se
+                # anexa si no hay ya un registro vigente.
+                record = encode_geometry(geojson)
+                generation = self._generation(conn)
+                with open(self._data_path(generation), "ab") as handle:
+                    offset = handle.seek(0, os.SEEK_END)
+                    handle.write(record)
+                conn.execute(
+                    "INSERT OR REPLACE INTO geometries (key, generation, offset, length, meta, created) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, generation, offset, len(record), json.dumps(meta, ensure_ascii=False), now),
+                )
+                self._maybe_compact(conn, generation, offset + len(record), now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return True
+
+    def _maybe_compact(self, conn: sqlite3.Connection, generation: int, size: int, now: float) -> None:
+        """Dentro de la transacción de `put`: reescribe el fichero si sobra más de la mitad."""
+        live_bytes = conn.execute(
+            "SELECT COALESCE(SUM(length), 0) FROM geometries WHERE created >= ?", (now - self.ttl,)
+        ).fetchone()[0]
+        if size < self.COMPACT_MIN_BYTES or live_bytes * 2 > size:
+            return
+        conn.execute("DELETE FROM geometries WHERE created < ?", (now - self.ttl,))
+        rows = conn.execute("SELECT key, offset, length FROM geometries ORDER BY offset").fetchall()
+        target = generation + 1
+        with open(self._data_path(generation), "rb") as source, open(self._data_path(target), "wb") as handle:
+            for key, offset, length in rows:
+                source.seek(offset)
+                conn.execute(
+                    "UPDATE geometries SET generation = ?, offset = ? WHERE key = ?", (target, handle.tell(), key)
+                )
+                handle.write(source.read(length))
+        conn.execute(
+            "INSERT OR REPLACE INTO store_state (name, value) VALUES ('generation', ?)", (target,)
+        )
+        # En Windows no se puede borrar un fichero mapeado: lo intentamos de nuevo
+        # en la siguiente compactación.
+        for old in range(target):
+            try:
+                os.remove(self._data_path(old))
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        if not self.directory:
+            return {"backend": "memory", **self._memory.stats()}
+        conn = self._connect()
+        count = conn.execute("SELECT COUNT(*) FROM geometries").fetchone()[0]
+        return {"backend": "mmap", "entries": count, "bytes": os.path.getsize(self.data_path)}
+
+
+GEOMETRY_STORE = GeometryStore(GEOMETRY_STORE_DIR or None, GEOMETRY_CACHE_TTL)
+
+
+def load_osm_geometry(osm_type: str, osm_id: int) -> Tuple[Dict[str, Any], GeometryRecord]:
+    """Geometría completa de un objeto OSM: del almacén binario o, si no está, de Nominatim."""
+    stored = GEOMETRY_STORE.get(osm_type, osm_id)
+    if stored is not None:
+        return stored
+
+    params = {
+        "osm_ids": f"{OSM_TYPE_CODES[osm_type]}{osm_id}",
+        "format": "json",
+        "polygon_geojson": 1,
+    }
+    response = nominatim_get(NOMINATIM_LOOKUP_ENDPOINT, params)
+    response.raise_for_status()
+    data = response.json()
+    geojson = data[0].get("geojson") if data else None
+    if not geojson or geojson.get("type") not in GEOMETRY_TYPE_CODES:
+        raise ValueError(f"No hay geometría disponible para {osm_type} {osm_id}.")
+
+    meta = {
+        "osm_type": osm_type,
+        "osm_id": osm_id,
+        "displayName": data[0].get("display_name"),
+        "bounding_box": data[0].get("boundingbox"),
+        # Se calculan sobre la geometría completa, antes de simplificar por zoom
+        "geometry_stats": geometry_stats(geojson),
+    }
+    GEOMETRY_STORE.put(osm_type, osm_id, geojson, meta)
+    return meta, decode_geometry(memoryview(encode_geometry(geojson)))
+
+
+def cache_place(key: Any, place: Dict[str, Any]) -> None:
+    """
+    Guarda un resultado de geocodificación. Los contornos van al almacén binario
+    y la entrada de caché conserva solo la referencia al objeto OSM.
+    """
+    geojson = place.get("geojson") or {}
+    if place.get("osm_id") and geojson.get("type") in GEOMETRY_TYPE_CODES:
+        meta = {key_: place.get(key_) for key_ in ("osm_type", "osm_id", "displayName", "bounding_box", "geometry_stats")}
+        if GEOMETRY_STORE.put(place["osm_type"], place["osm_id"], geojson, meta):
+            place = dict(place, geojson=None, geometry_ref=[place["osm_type"], place["osm_id"]])
+    GEOCODE_CACHE.set(key, place)
+
+
+def attach_stored_geometry(place: Dict[str, Any] | None) -> Dict[str, Any] | None:
+    """
+    Recompone una entrada de caché con `geometry_ref`; None si el contorno ya no
+    está. No se vuelve a inflar a listas: el navegador lo pide a /api/geometry,
+    como en el modo "lazy".
+    """
+    if not place or "geometry_ref" not in place:
+        return place
+    osm_type, osm_id = place["geometry_ref"]
+    if GEOMETRY_STORE.get(osm_type, osm_id) is None:
+        return None
+    place = {k: v for k, v in place.items() if k != "geometry_ref"}
+    place["geometry_url"] = f"/api/geometry/{osm_type}/{osm_id}"
+    return place
+
+
+def zoom_tolerance(zoom: int) -> float:
+    """Grados que ocupa GEOMETRY_SIMPLIFY_PIXELS en una tesela de 256px al zoom dado."""
+    return GEOMETRY_SIMPLIFY_PIXELS * 360.0 / (256 * 2 ** zoom)
+
+
+def simplify_coords(coords: np.ndarray, tolerance: float) -> np.ndarray:
+    """Douglas-Peucker iterativo y vectorizado sobre un array (n, 2) de [lon, lat]."""
+    if tolerance <= 0 or len(coords) < 3:
+        return coords
+    keep = np.zeros(len(coords), dtype=bool)
+    keep[0] = keep[-1] = True
+    tolerance_sq = tolerance * tolerance
+    stack = [(0, len(coords) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        delta = coords[end] - coords[start]
+        offsets = coords[start + 1:end] - coords[start]
+        segment_sq = float(delta @ delta)
+        if segment_sq:
+            t = np.clip(offsets @ delta / segment_sq, 0.0, 1.0)
+            offsets = offsets - np.outer(t, delta)
+        distances = np.einsum("ij,ij->i", offsets, offsets)
+        index = int(distances.argmax())
+        if distances[index] > tolerance_sq:
+            index += start + 1
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+    return coords[keep]
+
+
+def simplified_geometry_body(osm_type: str, osm_id: int, zoom: int | None) -> str:
+    """
+    Cuerpo JSON de /api/geometry; los simplificados se serializan una vez por
+    objeto y zoom. La resolución completa se rehace en cada petición: el
+    navegador la pide con `format=binary` (ver `geometry_binary_body`).
+    """
+    if zoom is None:
+        meta, record = load_osm_geometry(osm_type, osm_id)
+        return json.dumps(dict(meta, zoom=None, geojson=record_to_geojson(record, 0.0)), separators=(",", ":"))
+    key = (osm_type, osm_id, zoom)
+    body = SIMPLIFIED_GEOMETRY_CACHE.get(key)
+    if body is None:
+        meta, record = load_osm_geometry(osm_type, osm_id)
+        geojson = record_to_geojson(record, zoom_tolerance(zoom))
+        body = json.dumps(dict(meta, zoom=zoom, geojson=geojson), separators=(",", ":"))
+        SIMPLIFIED_GEOMETRY_CACHE.set(key, body)
+    return body
+
+
+def geometry_binary_body(osm_type: str, osm_id: int, zoom: int | None) -> bytes:
+    """Registro "GEO1" tal cual está en el almacén, o re-codificado si se simplifica."""
+    _, record = load_osm_geometry(osm_type, osm_id)
+    if zoom is None:
+        return bytes(record.raw)
+    return encode_geometry(record_to_geojson(record, zoom_tolerance(zoom)))
+
+
 def geocode_multiple(query: str, limit: int = 10, viewbox: str | None = None) -> List[Dict[str, Any]]:
     params = {
         "q": query,
@@ -157,12 +1615,7 @@ def geocode_multiple(query: str, limit: int = 10, viewbox: str | None = None) ->
     if viewbox:
         params["viewbox"] = viewbox
 
-    response = requests.get(
-        NOMINATIM_ENDPOINT,
-        params=params,
-        timeout=15,
-        headers={"User-Agent": NOMINATIM_USER_AGENT},
-    )
+    response = nominatim_get(NOMINATIM_ENDPOINT, params)
     response.raise_for_status()
     data = response.json()
     if not data:
@@ -181,6 +1634,256 @@ def geocode_multiple(query: str, limit: int = 10, viewbox: str | None = None) ->
     return results
 
 
+AUTOCOMPLETE_CACHE = SharedCache("autocomplete", GEOCODE_CACHE_SIZE, GEOCODE_CACHE_TTL)
+
+
+def autocomplete_places(prefix: str, limit: int = AUTOCOMPLETE_LIMIT, viewbox: str | None = None) -> List[Dict[str, Any]]:
+    """
+    Sugerencias para un texto a medio escribir, pedidas a AUTOCOMPLETE_ENDPOINT.
+    Si ya tenemos en caché las sugerencias completas (no recortadas por `limit`)
+    del texto sin su última palabra, las filtramos en lugar de consultar de nuevo.
+    """
+    key = (*geocode_cache_key(prefix, False, viewbox), limit)
+    entry = AUTOCOMPLETE_CACHE.get(key)
+    if entry is None:
+        head, _, partial = key[0].rpartition(" ")
+        head_key = (head, False, key[2], limit)
+        if len(head) >= AUTOCOMPLETE_MIN_CHARS and AUTOCOMPLETE_CACHE.peek(head_key):
+            cached = AUTOCOMPLETE_CACHE.get(head_key)
+            # Con la lista recortada, lo que falta podría coincidir con la palabra nueva
+            if not cached["truncated"]:
+                entry = {
+                    "results": [
+                        res for res in cached["results"] if partial in fold_text(res.get("displayName") or "")
+                    ],
+                    "truncated": False,
+                }
+    if entry is None:
+        params = {"q": prefix, "format": "json", "limit": limit}
+        if viewbox:
+            params["viewbox"] = viewbox
+        with trace_span("pace.autocomplete"):
+            pace_upstream("autocomplete", AUTOCOMPLETE_MIN_INTERVAL, NOMINATIM_MAX_WAIT)
+        response = traced_request(
+            "GET",
+            AUTOCOMPLETE_ENDPOINT,
+            "autocomplete",
+            params=params,
+            timeout=upstream_timeout(5),
+            headers={"User-Agent": NOMINATIM_USER_AGENT},
+        )
+        response.raise_for_status()
+        data = response.json()
+        # Las sugerencias no necesitan contorno; solo lo que pinta la lista
+        entry = {
+            "results": [
+                {
+                    "displayName": res.get("display_name"),
+                    "lat": float(res["lat"]),
+                    "lon": float(res["lon"]),
+                    "bounding_box": res.get("boundingbox"),
+                }
+                for res in data
+            ],
+            "truncated": len(data) >= limit,
+        }
+        AUTOCOMPLETE_CACHE.set(key, entry)
+    return entry["results"][:limit]
+
+
+# --- Búsqueda paginada y agrupación ---
+
+NOMINATIM_PAGE_SIZE = 40  # máximo que admite Nominatim por petición
+# Entradas {"points": [...], "truncated": bool}
+SEARCH_RESULTS_CACHE = SharedCache("paged-search", 64, GEOCODE_CACHE_TTL)
+_SEARCH_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="paged-search")
+
+
+def parse_viewbox(viewbox: str | None) -> Tuple[float, float, float, float] | None:
+    """Convierte "oeste,norte,este,sur" (formato del cliente) en (oeste, sur, este, norte)."""
+    try:
+        x1, y1, x2, y2 = (float(v) for v in (viewbox or "").split(","))
+    except ValueError:
+        return None
+    return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+
+
+def search_tiles(viewbox: str | None, split: int) -> List[str | None]:
+    bounds = parse_viewbox(viewbox)
+    if bounds is None or split <= 1:
+        return [viewbox]
+    west, south, east, north = bounds
+    step_x, step_y = (east - west) / split, (north - south) / split
+    return [
+        f"{west + i * step_x},{south + (j + 1) * step_y},{west + (i + 1) * step_x},{south + j * step_y}"
+        for i in range(split)
+        for j in range(split)
+    ]
+
+
+def paged_search(
+    query: str, viewbox: str | None = None, max_results: int = SEARCH_MAX_RESULTS
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Reúne hasta max_results lugares: cada tesela del viewbox se consulta en
+    paralelo (bounded=1) y se pagina excluyendo los place_id ya vistos.
+
+    Devuelve los lugares y si la búsqueda quedó incompleta: se deja de paginar
+    cuando el plazo de la petición no da para más, y el fallo de una tesela
+    detiene las demás pero no descarta lo ya reunido.
+    """
+    seen: Dict[int, Dict[str, Any]] = {}
+    errors: List[Exception] = []
+    stop = threading.Event()
+    lock = threading.Lock()
+
+    def fetch_tile(tile: str | None) -> None:
+        excluded: List[str] = []
+        for _ in range(SEARCH_MAX_PAGES):
+            with lock:
+                if len(seen) >= max_results:
+                    return
+            remaining = remaining_time()
+            if stop.is_set() or (remaining is not None and remaining < SEARCH_DEADLINE_RESERVE):
+                stop.set()
+                return
+            params: Dict[str, Any] = {"q": query, "format": "json", "limit": NOMINATIM_PAGE_SIZE}
+            if tile:
+                params.update(viewbox=tile, bounded=1)
+            if excluded:
+                params["exclude_place_ids"] = ",".join(excluded)
+            try:
+                response = nominatim_get(NOMINATIM_ENDPOINT, params)
+                response.raise_for_status()
+                page = response.json()
+            except Exception as exc:  # noqa: BLE001 - se devuelve lo reunido hasta ahora
+                with lock:
+                    errors.append(exc)
+                stop.set()
+                return
+            with lock:
+                for res in page:
+                    if len(seen) < max_results and res.get("place_id") not in seen:
+                        seen[res["place_id"]] = {
+                            "displayName": res.get("display_name"),
+                            "lat": float(res["lat"]),
+                            "lon": float(res["lon"]),
+                        }
+            excluded.extend(str(res["place_id"]) for res in page)
+            if len(page) < NOMINATIM_PAGE_SIZE:
+                return
+
+    tiles = search_tiles(viewbox, SEARCH_TILE_SPLIT)
+    futures = [_SEARCH_EXECUTOR.submit(contextvars.copy_context().run, fetch_tile, tile) for tile in tiles]
+    for future in futures:
+        future.result()
+    if not seen:
+        if errors:
+            raise errors[0]
+        raise ValueError(f"No se encontraron resultados para '{query}'.")
+    current_span().set_attributes(**{"search.truncated": stop.is_set(), "search.errors": len(errors)})
+    return list(seen.values()), stop.is_set()
+
+
+def mercator_xy(points: List[Dict[str, Any]]) -> np.ndarray:
+    """Coordenadas Web Mercator normalizadas a [0, 1] (como las teselas del mapa)."""
+    lon = np.array([p["lon"] for p in points], dtype=np.float64)
+    lat = np.clip(np.array([p["lat"] for p in points], dtype=np.float64), -85.05112878, 85.05112878)
+    x = (lon + 180.0) / 360.0
+    sin_lat = np.sin(np.radians(lat))
+    y = 0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)
+    return np.column_stack([x, y])
+
+
+def grid_cells(xy: np.ndarray, zoom: int) -> np.ndarray:
+    """Celda de la rejilla de CLUSTER_RADIUS_PX píxeles a la que cae cada punto en ese zoom."""
+    cells_per_side = 256 * 2 ** zoom / CLUSTER_RADIUS_PX
+    cx = np.floor(xy[:, 0] * cells_per_side).astype(np.int64)
+    cy = np.floor(xy[:, 1] * cells_per_side).astype(np.int64)
+    return cx * (int(cells_per_side) + 2) + cy
+
+
+def expansion_zoom(xy: np.ndarray, zoom: int) -> int:
+    """Primer zoom en el que los puntos de un grupo dejan de caer en la misma celda."""
+    for candidate in range(zoom + 1, CLUSTER_MAX_ZOOM + 1):
+        if len(np.unique(grid_cells(xy, candidate))) > 1:
+            return candidate
+    return CLUSTER_MAX_ZOOM + 1
+
+
+def cluster_points(points: List[Dict[str, Any]], zoom: int, viewbox: str | None = None) -> List[Dict[str, Any]]:
+    """
+    Agrupa los puntos en una rejilla jerárquica por zoom (celdas fijas en
+    píxeles de pantalla). Solo devuelve lo que cae en el viewbox indicado.
+    """
+    if not points:
+        return []
+    bounds = parse_viewbox(viewbox)
+    if bounds is not None:
+        west, south, east, north = bounds
+        points = [p for p in points if west <= p["lon"] <= east and south <= p["lat"] <= north]
+        if not points:
+            return []
+    zoom = max(0, min(zoom, CLUSTER_MAX_ZOOM + 1))
+    xy = mercator_xy(points)
+    lat = np.array([p["lat"] for p in points])
+    lon = np.array([p["lon"] for p in points])
+    if zoom > CLUSTER_MAX_ZOOM:
+        cells, inverse = np.arange(len(points)), np.arange(len(points))
+    else:
+        cells, inverse = np.unique(grid_cells(xy, zoom), return_inverse=True)
+    counts = np.bincount(inverse)
+    lat_mean = np.bincount(inverse, weights=lat) / counts
+    lon_mean = np.bincount(inverse, weights=lon) / counts
+
+    clusters = []
+    for index, cell in enumerate(cells):
+        if counts[index] == 1:
+            point = points[int(np.flatnonzero(inverse == index)[0])]
+            clusters.append({"type": "point", **point})
+            continue
+        members = inverse == index
+        clusters.append({
+            "type": "cluster",
+            "id": f"{zoom}:{int(cell)}",
+            "count": int(counts[index]),
+            "lat": round(float(lat_mean[index]), 7),
+            "lon": round(float(lon_mean[index]), 7),
+            "expansion_zoom": expansion_zoom(xy[members], zoom),
+            "bounding_box": [
+                float(lat[members].min()), float(lat[members].max()),
+                float(lon[members].min()), float(lon[members].max()),
+            ],
+        })
+    return clusters
+
+
+def start_paged_search(query: str, viewbox: str | None, limit: int, zoom: int) -> Dict[str, Any]:
+    """Lanza (o reutiliza) una búsqueda paginada y devuelve su primera vista agrupada."""
+    max_results = min(limit, SEARCH_MAX_RESULTS)
+    result_id = hashlib.sha1(json.dumps([query_key(query), viewbox, max_results]).encode()).hexdigest()[:16]
+    cached = SEARCH_RESULTS_CACHE.get(result_id)
+    if cached is None or cached["truncated"]:
+        # Una búsqueda incompleta se repite; si vuelve a quedarse corta,
+        # conservamos la que más lugares reunió.
+        points, truncated = paged_search(query, viewbox=viewbox, max_results=max_results)
+        if cached is None or len(points) >= len(cached["points"]) or not truncated:
+            cached = {"points": points, "truncated": truncated}
+            SEARCH_RESULTS_CACHE.set(result_id, cached)
+    points = cached["points"]
+    lat = [p["lat"] for p in points]
+    lon = [p["lon"] for p in points]
+    return {
+        "query": query,
+        "result_id": result_id,
+        "total": len(points),
+        "truncated": cached["truncated"],
+        "zoom": zoom,
+        "bounding_box": [min(lat), max(lat), min(lon), max(lon)],
+        "clusters": cluster_points(points, zoom),
+    }
+
+
 def geocode_pair(origin: str, destination: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
     start = geocode_place(origin)
     end = geocode_place(destination)
@@ -188,29 +1891,149 @@ def geocode_pair(origin: str, destination: str) -> Tuple[Dict[str, Any], Dict[st
 
 
 
+# --- Rutas (OSRM) ---
+# route_between y el proxy /api/osrm comparten una misma petición canónica a
+# OSRM (geometría completa en GeoJSON, pasos y alternativas): la respuesta en
+# caché sirve a ambos y al cliente se le adapta el formato que pidió.
+
+OSRM_BACKENDS: Dict[str, Tuple[str, ...]] = {
+    "driving": (f"{OSRM_ENDPOINT}/driving", f"{OSRM_FALLBACK_ENDPOINT}/routed-car/route/v1/driving"),
+    # El servidor principal solo tiene perfil de coche
+    "walking": (f"{OSRM_FALLBACK_ENDPOINT}/routed-foot/route/v1/foot",),
+    "cycling": (f"{OSRM_FALLBACK_ENDPOINT}/routed-bike/route/v1/cycling",),
+}
+OSRM_UPSTREAM_PARAMS = {
+    "overview": "full",
+    "geometries": "geojson",
+    "alternatives": "true",
+    "steps": "true",
+}
+ROUTE_CACHE = SharedCache("route", ROUTE_CACHE_SIZE, ROUTE_CACHE_TTL)
+
+OSRM_SESSION = requests.Session()
+OSRM_SESSION.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+
+class OSRMResponseError(Exception):
+    """Respuesta de OSRM sin ruta (p.ej. NoRoute); se reenvía tal cual al cliente."""
+
+    def __init__(self, status_code: int, payload: Dict[str, Any]) -> None:
+        super().__init__(payload.get("message") or payload.get("code") or f"HTTP {status_code}")
+        self.status_code = status_code
+        self.payload = payload
+
+
+def route_cache_key(profile: str, coordinates: List[Tuple[float, float]]) -> Tuple[str, str]:
+    # 6 decimales (~10 cm): los mismos puntos llegan con distinta cola de decimales
+    return profile, ";".join(f"{lon:.6f},{lat:.6f}" for lon, lat in coordinates)
+
+
+def fetch_osrm_route(profile: str, coordinates: List[Tuple[float, float]]) -> Dict[str, Any]:
+    """
+    Respuesta OSRM canónica para unos puntos, desde ROUTE_CACHE o probando los
+    servidores del perfil en orden hasta que uno responda sin error 5xx.
+    """
+    profile = normalise_profile(profile)
+    key = route_cache_key(profile, coordinates)
+    data = ROUTE_CACHE.get(key)
+    if data is not None:
+        return data
+
+    last_error: Exception | None = None
+    for base_url in OSRM_BACKENDS[profile]:
+        with trace_span("pace.osrm"):
+            pace_upstream("osrm", OSRM_MIN_INTERVAL, OSRM_MAX_WAIT)
+        try:
+            response = traced_request(
+                "GET", f"{base_url}/{key[1]}", "osrm", session=OSRM_SESSION, params=OSRM_UPSTREAM_PARAMS,
+                timeout=upstream_timeout(20),
+            )
+        except DeadlineExceeded:
+            raise
+        except requests_exceptions.RequestException as exc:
+            last_error = exc
+            continue
+        if response.status_code >= 500:
+            last_error = requests.HTTPError(f"{response.status_code} Server Error: {base_url}", response=response)
+            continue
+        try:
+            data = response.json()
+        except ValueError:
+            response.raise_for_status()
+            raise
+        if not response.ok or data.get("code") != "Ok":
+            raise OSRMResponseError(response.status_code, data)
+        ROUTE_CACHE.set(key, data)
+        return data
+    assert last_error is not None
+    raise last_error
+
+
+def encode_polyline(coords: List[List[float]], precision: int = 5) -> str:
+    """Codifica coordenadas GeoJSON [lon, lat] en el formato polyline de Google."""
+    factor = 10 ** precision
+    chunks: List[str] = []
+    prev_lat = prev_lon = 0
+    for lon, lat, *_ in coords:
+        lat_i, lon_i = int(round(lat * factor)), int(round(lon * factor))
+        for delta in (lat_i - prev_lat, lon_i - prev_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                chunks.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            chunks.append(chr(value + 63))
+        prev_lat, prev_lon = lat_i, lon_i
+    return "".join(chunks)
+
+
+def osrm_client_response(data: Dict[str, Any], options: Dict[str, str]) -> Dict[str, Any]:
+    """Adapta la respuesta canónica a los parámetros overview/geometries/steps/alternatives del cliente."""
+    geometries = options.get("geometries", "polyline")
+    overview = options.get("overview", "simplified")
+    steps = options.get("steps", "false") == "true"
+    alternatives = options.get("alternatives", "false") != "false"
+
+    def convert(geometry: Dict[str, Any]) -> Any:
+        if geometries == "geojson":
+            return geometry
+        return encode_polyline(geometry["coordinates"], 6 if geometries == "polyline6" else 5)
+
+    routes = []
+    for route in data.get("routes", [])[: None if alternatives else 1]:
+        route = dict(route)
+        if overview == "false":
+            route.pop("geometry", None)
+        else:
+            route["geometry"] = convert(route["geometry"])
+        legs = []
+        for leg in route.get("legs", []):
+            leg = dict(leg)
+            leg["steps"] = [dict(step, geometry=convert(step["geometry"])) for step in leg.get("steps", [])] if steps else []
+            legs.append(leg)
+        route["legs"] = legs
+        routes.append(route)
+    return dict(data, routes=routes)
+
+
+def parse_osrm_coordinates(raw: str) -> List[Tuple[float, float]]:
+    try:
+        coordinates = [(float(lon), float(lat)) for lon, lat in (pair.split(",") for pair in raw.split(";"))]
+    except ValueError:
+        raise ValueError("Las coordenadas deben tener el formato lon,lat;lon,lat.") from None
+    if not 2 <= len(coordinates) <= 25:
+        raise ValueError("Se necesitan entre 2 y 25 coordenadas.")
+    if any(not (-180 <= lon <= 180 and -90 <= lat <= 90) for lon, lat in coordinates):
+        raise ValueError("Coordenadas fuera de rango.")
+    return coordinates
+
+
 def route_between(origin: str, destination: str, profile: str = "driving") -> Dict[str, Any]:
     start, end = geocode_pair(origin, destination)
-    params = {
-        "overview": "full",
-        "geometries": "geojson",
-        "alternatives": "false",
-        "steps": "true",
-    }
     profile = normalise_profile(profile)
-    
-    # Choose endpoint based on profile to avoid 502 errors on main server
-    if profile == "walking":
-        base_url = "https://routing.openstreetmap.de/routed-foot/route/v1/foot"
-    elif profile == "cycling":
-        base_url = "https://routing.openstreetmap.de/routed-bike/route/v1/cycling"
-    else:
-        # Default driving
-        base_url = f"{OSRM_ENDPOINT}/{profile}"
-
-    url = f"{base_url}/{start['lon']},{start['lat']};{end['lon']},{end['lat']}"
-    response = requests.get(url, params=params, timeout=20)
-    response.raise_for_status()
-    data = response.json()
+    try:
+        data = fetch_osrm_route(profile, [(start["lon"], start["lat"]), (end["lon"], end["lat"])])
+    except OSRMResponseError as exc:
+        raise ValueError("No se pudo calcular la ruta solicitada.") from exc
     routes = data.get("routes") or []
     if not routes:
         raise ValueError("No se pudo calcular la ruta solicitada.")
@@ -264,6 +2087,9 @@ def extract_error_message(payload: Dict[str, Any]) -> str | None:
     return None
 
 
+GEMINI_VERSION_KEY = f"gemini:api_version:{GEMINI_MODEL}"
+
+
 def request_plan_from_gemini(prompt: str, history: List[Dict[str, str]] | None = None) -> Dict[str, Any]:
     ensure_ai_available()
     model_path = normalise_model_name(GEMINI_MODEL)
@@ -304,15 +2130,23 @@ def request_plan_from_gemini(prompt: str, history: List[Dict[str, str]] | None =
 
     version_errors: List[str] = []
 
-    for version in GOOGLE_API_VERSIONS:
+    # Probamos primero la versión de la API que ya funcionó en cualquier proceso
+    discovered = (SHARED_STORE.get(GEMINI_VERSION_KEY) or b"").decode()
+    versions = sorted(GOOGLE_API_VERSIONS, key=lambda v: v != discovered)
+
+    for version in versions:
         url = f"{GOOGLE_API_BASE_URL}/{version}/{model_path}:generateContent"
         try:
-            response = requests.post(
+            response = traced_request(
+                "POST",
                 url,
+                "gemini",
                 params={"key": GEMINI_API_KEY},
                 json=payload,
-                timeout=30,
+                timeout=upstream_timeout(30),
             )
+        except DeadlineExceeded:
+            raise
         except requests_exceptions.RequestException as exc:
             version_errors.append(f"{version}: conexión fallida ({exc}).")
             continue
@@ -358,6 +2192,8 @@ def request_plan_from_gemini(prompt: str, history: List[Dict[str, str]] | None =
         if not isinstance(plan["actions"], list):
             raise AssistantPlanningError("El campo 'actions' debe ser una lista.")
 
+        if version != discovered:
+            SHARED_STORE.set(GEMINI_VERSION_KEY, version.encode(), 86400)
         return plan
 
     raise AssistantPlanningError(
@@ -366,28 +2202,223 @@ def request_plan_from_gemini(prompt: str, history: List[Dict[str, str]] | None =
     )
 
 
-import re
+# --- Precarga especulativa ---
+# Mientras Gemini planifica, extraemos del prompt los nombres de lugar más
+# probables y los geocodificamos en segundo plano para que `execute_action`
+# los encuentre ya en GEOCODE_CACHE.
 
-def clean_search_query(query: str) -> str:
+_CLAUSE_SPLIT = re.compile(r"[.;!?\n]+|,\s+|\s+y\s+", re.IGNORECASE)
+_ROUTE_HINT = re.compile(r"\b(ruta|rutas|ir|llegar|camino|trayecto|itinerario)\b", re.IGNORECASE)
+_ROUTE_PATTERNS = (
+    re.compile(r"\bdesde\s+(?P<origin>.+?)\s+(?:a|al|hasta|hacia)\s+(?P<destination>.+)", re.IGNORECASE),
+    re.compile(r"\b(?:de|del)\s+(?P<origin>.+?)\s+(?:a|al|hasta|hacia)\s+(?P<destination>.+)", re.IGNORECASE),
+)
+_ROUTE_TAIL = re.compile(
+    r"\s+(?:(?:en|a)\s+(?:coche|bici|bicicleta|pie|moto|transporte)|andando|caminando|pedaleando)\b.*$",
+    re.IGNORECASE,
+)
+_POLYGON_HINT = re.compile(
+    r"\b(distrito|arrondissement|barrio|contorno|per[ií]metro|[áa]rea|zona|traza|trazado|calle|rue|r[ií]o|parque)\b",
+    re.IGNORECASE,
+)
+_PLACE_PHRASE = re.compile(
+    r"[A-ZÁÉÍÓÚÑÜ][\w'’.-]*"
+    r"(?:\s+(?:(?:de|del|la|las|los|el|des|du|le|di|da)\s+)*[A-ZÁÉÍÓÚÑÜ0-9][\w'’.-]*)*"
+)
+# Las búsquedas de categorías van por `geocode_multiple`, que no usa la precarga
+_SEARCH_HINT = re.compile(r"\b(todas|todos|tiendas|cadena|sucursales|cerca de)\b", re.IGNORECASE)
+# "Museo del Prado en Madrid" se pide como "Museo del Prado, Madrid"
+_PHRASE_JOINER = re.compile(r"\s+en\s+", re.IGNORECASE)
+_QUERY_WORD = re.compile(r"\w+")
+# Se comparan con `fold_text`: "Enséñame", "enseñame" y "ENSEÑAME" son el mismo comando
+_COMMAND_WORDS = {
+    fold_text(word)
+    for word in (
+        "busca", "buscar", "calcula", "dibuja", "encuentra", "enseña", "enséñame", "hola", "llévame",
+        "localiza", "marca", "mira", "muestra", "muéstrame", "quiero", "ruta", "traza", "ver",
+    )
+}
+# Artículos en minúscula que quedan al quitar el comando ("Traza la Rue de Buci").
+# Con mayúscula son parte del nombre ("El Salvador", "La Paz") y se conservan.
+_LEADING_ARTICLES = {"el", "la", "los", "las", "un", "una"}
+
+
+def extract_place_candidates(prompt: str, viewbox: str | None = None) -> List[Tuple[str, bool, str | None]]:
     """
-    Mejora la consulta para Nominatim eliminando ruidos y normalizando.
-    Intentamos mantener 'de' si parece parte de un nombre (Rue de la Paix).
+    Extrae del texto libre los lugares que probablemente pedirá el plan, como
+    tuplas (query, include_polygon, viewbox) iguales a las de `execute_action`.
     """
-    if not query:
-        return ""
-    
-    # Normalizar espacios
-    clean = re.sub(r'\s+', ' ', query.strip())
-    
-    # Eliminar ruidos al inicio que suelen ser conectores de lenguaje natural o comandos
-    # Ex: "Localiza el Museo del Prado" -> "Museo del Prado"
-    noise_start = r'^(el|la|los|las|un|una|en|desde|hacia|mira|busca|localiza|enseñame|marca)\s+'
-    clean = re.sub(noise_start, '', clean, flags=re.IGNORECASE)
-    
-    # "Museo del Prado en Madrid" -> "Museo del Prado Madrid"
-    clean = re.sub(r'\s+en\s+', ' ', clean, flags=re.IGNORECASE)
-    
-    return clean.strip()
+    found: List[Tuple[str, bool, str | None]] = []
+
+    def add(raw: str, include_polygon: bool, box: str | None) -> None:
+        if raw.strip():
+            found.append((raw, include_polygon, box))
+
+    for clause in _CLAUSE_SPLIT.split(prompt or ""):
+        clause = clause.strip()
+        if not clause:
+            continue
+        if _ROUTE_HINT.search(clause):
+            match = next((m for m in (p.search(clause) for p in _ROUTE_PATTERNS) if m), None)
+            if match:
+                # Las rutas se geocodifican sin viewbox (ver `route_between`)
+                add(match.group("origin"), False, None)
+                add(_ROUTE_TAIL.sub("", match.group("destination")), False, None)
+                continue
+        if _SEARCH_HINT.search(clause):
+            continue
+        include_polygon = bool(_POLYGON_HINT.search(clause))
+        # "el distrito 5 de París" es un único lugar, no "París"
+        clause = normalize_place_names(clause)
+        phrases: List[str] = []
+        previous_end = None
+        for match in _PLACE_PHRASE.finditer(clause):
+            words = match.group(0).split()
+            while words and (fold_text(words[0]) in _COMMAND_WORDS or words[0] in _LEADING_ARTICLES):
+                words.pop(0)
+            if not words:
+                continue
+            if phrases and _PHRASE_JOINER.fullmatch(clause[previous_end:match.start()]):
+                phrases[-1] = f"{phrases[-1]}, {' '.join(words)}"
+            else:
+                phrases.append(" ".join(words))
+            previous_end = match.end()
+        for phrase in phrases:
+            add(phrase, include_polygon, viewbox)
+
+    # Una sola normalización para todo el prompt; las variantes de un mismo
+    # lugar comparten clave y solo se precargan una vez.
+    normalized = normalize_queries(raw for raw, _, _ in found)
+    candidates: List[Tuple[str, bool, str | None]] = []
+    seen = set()
+    for raw, include_polygon, box in found:
+        query = normalized[raw].display
+        key = (normalized[raw].key, include_polygon, box or "")
+        if len(query) >= 3 and key not in seen:
+            seen.add(key)
+            candidates.append((query, include_polygon, box))
+    return candidates
+
+
+class SpeculativePrefetcher:
+    """Geocodifica en segundo plano los candidatos del prompt y mide su acierto."""
+
+    def __init__(self, max_candidates: int, max_pending: int, workers: int) -> None:
+        self.max_candidates = max_candidates
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="geocode-prefetch")
+        self._pending: Dict[Any, Future] = {}
+        # Claves precargadas que aún no ha pedido ningún plan
+        self._unclaimed = TTLCache(GEOCODE_CACHE_SIZE, GEOCODE_CACHE_TTL)
+        self._lock = threading.Lock()
+        self._stats = {"scheduled": 0, "skipped": 0, "failed": 0, "hits": 0, "ready_on_arrival": 0}
+
+    def schedule(self, prompt: str, context: Dict[str, Any] | None = None) -> int:
+        if self.max_candidates <= 0:
+            return 0
+        viewbox = context.get("viewbox") if context else None
+        scheduled = 0
+        for query, include_polygon, box in extract_place_candidates(prompt, viewbox)[: self.max_candidates]:
+            key = geocode_cache_key(query, include_polygon, box)
+            with self._lock:
+                if key in self._pending or len(self._pending) >= self.max_pending:
+                    self._stats["skipped"] += 1
+                    continue
+                if GEOCODE_CACHE.peek(key):
+                    self._stats["skipped"] += 1
+                    continue
+                # Los spans de la precarga cuelgan de la traza de la petición que la originó
+                future = self._executor.submit(
+                    contextvars.copy_context().run, self._run, key, query, include_polygon, box
+                )
+                self._pending[key] = future
+                self._stats["scheduled"] += 1
+            future.add_done_callback(lambda _f, key=key: self._forget(key))
+            scheduled += 1
+        return scheduled
+
+    def _run(self, key: Any, query: str, include_polygon: bool, viewbox: str | None) -> Dict[str, Any]:
+        try:
+            with trace_span("prefetch.geocode", query=query, include_polygon=include_polygon):
+                place = fetch_place(query, include_polygon=include_polygon, viewbox=viewbox)
+        except Exception:
+            with self._lock:
+                self._stats["failed"] += 1
+            raise
+        cache_place(key, place)
+        self._unclaimed.set(key, True)
+        return place
+
+    def _forget(self, key: Any) -> None:
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def wait_for(self, key: Any) -> Dict[str, Any] | None:
+        with self._lock:
+            future = self._pending.get(key)
+        if future is None:
+            return None
+        try:
+            with trace_span("prefetch.wait", **{"prefetch.ready": future.done()}):
+                return future.result(timeout=upstream_timeout(PREFETCH_WAIT_TIMEOUT))
+        except ValueError:
+            # Nominatim ya respondió que no hay resultados: no repetimos la consulta
+            self._count_hit(ready=False)
+            raise
+        except Exception:  # noqa: BLE001 - la petición normal se encargará del error
+            return None
+
+    def claim_extension(self, key: Any) -> Dict[str, Any] | None:
+        """
+        El plan suele añadir ciudad y país a lo que escribió el usuario ("Madrid"
+        -> "Madrid, España"). Si la clave del plan amplía una clave precargada y
+        el resultado precargado ya contiene esas palabras en su nombre completo,
+        lo reutilizamos en lugar de volver a consultar a Nominatim.
+        """
+        text, include_polygon, box = key
+        words = text.split(" ")
+        for size in range(len(words) - 1, 0, -1):
+            base_key = (" ".join(words[:size]).rstrip(","), include_polygon, box)
+            with self._lock:
+                future = self._pending.get(base_key)
+            if future is None and not self._unclaimed.peek(base_key):
+                continue
+            ready = future is None or future.done()
+            if future is not None:
+                try:
+                    with trace_span("prefetch.wait", **{"prefetch.ready": ready}):
+                        future.result(timeout=upstream_timeout(PREFETCH_WAIT_TIMEOUT))
+                except Exception:  # noqa: BLE001 - sin resultado precargado se consulta normalmente
+                    continue
+            place = attach_stored_geometry(GEOCODE_CACHE.get(base_key))
+            if place is None:
+                continue
+            full_name = set(_QUERY_WORD.findall(fold_text(place.get("displayName") or "")))
+            if all(word in full_name for word in _QUERY_WORD.findall(" ".join(words[size:]))):
+                self.record_use(base_key, ready=ready)
+                return place
+        return None
+
+    def record_use(self, key: Any, ready: bool) -> None:
+        if self._unclaimed.pop(key):
+            self._count_hit(ready=ready)
+
+    def _count_hit(self, ready: bool) -> None:
+        with self._lock:
+            self._stats["hits"] += 1
+            if ready:
+                self._stats["ready_on_arrival"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats, pending=len(self._pending))
+        scheduled = stats["scheduled"]
+        stats["hit_rate"] = round(stats["hits"] / scheduled, 3) if scheduled else None
+        return stats
+
+
+GEOCODE_PREFETCHER = SpeculativePrefetcher(PREFETCH_MAX_CANDIDATES, PREFETCH_MAX_PENDING, PREFETCH_WORKERS)
+
 
 def execute_action(action: Dict[str, Any], context: Dict[str, Any] | None = None) -> Dict[str, Any]:
     action_type = action.get("type")
@@ -400,14 +2431,14 @@ def execute_action(action: Dict[str, Any], context: Dict[str, Any] | None = None
             raise ValueError("La acción 'place' necesita el parámetro 'query'.")
         
         cleaned = clean_search_query(query)
-        print(f"DEBUG: Geocoding (place) '{query}' -> cleaned: '{cleaned}' (viewbox={viewbox})")
+        current_span().set_attributes(query=query, cleaned=cleaned, viewbox=viewbox)
         
         try:
             place = geocode_place(cleaned, include_polygon=bool(params.get("include_polygon")), viewbox=viewbox)
         except ValueError:
             # Fallback a raw query if cleaned fails
             if cleaned != query:
-                print(f"DEBUG: Cleaned failed, retrying raw: '{query}'")
+                current_span().add_event("retry_raw_query", query=query)
                 try:
                     place = geocode_place(query, include_polygon=bool(params.get("include_polygon")), viewbox=viewbox)
                 except ValueError as e:
@@ -424,13 +2455,25 @@ def execute_action(action: Dict[str, Any], context: Dict[str, Any] | None = None
             raise ValueError("La acción 'search' necesita el parámetro 'query'.")
         
         cleaned = clean_search_query(query)
-        print(f"DEBUG: Geocoding (search) '{query}' -> cleaned: '{cleaned}' (limit={limit}, viewbox={viewbox})")
+        current_span().set_attributes(query=query, cleaned=cleaned, limit=limit, viewbox=viewbox)
         
+        if int(limit) > SEARCH_PAGED_THRESHOLD:
+            # Categorías amplias: paginamos y devolvemos grupos en vez de cada punto
+            zoom = int((context or {}).get("zoom") or 12)
+            try:
+                result = start_paged_search(cleaned, viewbox, int(limit), zoom)
+            except ValueError:
+                if cleaned == query:
+                    raise
+                current_span().add_event("retry_raw_query", query=query)
+                result = start_paged_search(query, viewbox, int(limit), zoom)
+            return {"type": "search_clusters", "payload": result}
+
         try:
             places = geocode_multiple(cleaned, limit=int(limit), viewbox=viewbox)
         except ValueError:
             if cleaned != query:
-                print(f"DEBUG: Cleaned search failed, retrying raw: '{query}'")
+                current_span().add_event("retry_raw_query", query=query)
                 places = geocode_multiple(query, limit=int(limit), viewbox=viewbox)
             else:
                 raise
@@ -443,15 +2486,15 @@ def execute_action(action: Dict[str, Any], context: Dict[str, Any] | None = None
             raise ValueError("La acción 'area' necesita el parámetro 'query'.")
             
         cleaned = clean_search_query(query)
-        print(f"DEBUG: Geocoding (area) '{query}' -> cleaned: '{cleaned}' (viewbox={viewbox})")
+        current_span().set_attributes(query=query, cleaned=cleaned, viewbox=viewbox)
         try:
              place = geocode_place(cleaned, include_polygon=True, viewbox=viewbox)
              # Validar si devolvió un polígono útil
-             if place.get("geojson", {}).get("type") == "Point":
-                 print(f"DEBUG: '{cleaned}' devolvió un punto en vez de área.")
+             if (place.get("geojson") or {}).get("type") == "Point" or place.get("osm_type") == "node":
+                 current_span().add_event("area_is_point", query=cleaned)
         except ValueError:
              if cleaned != query:
-                  print(f"DEBUG: Cleaned area failed, retrying raw: '{query}'")
+                  current_span().add_event("retry_raw_query", query=query)
                   place = geocode_place(query, include_polygon=True, viewbox=viewbox)
              else:
                   raise
@@ -475,7 +2518,7 @@ def execute_action(action: Dict[str, Any], context: Dict[str, Any] | None = None
         except ValueError:
              # Retry raw
              if cleaned_origin != origin or cleaned_dest != destination:
-                  print(f"DEBUG: Cleaned route failed, retrying raw: '{origin}' -> '{destination}'")
+                  current_span().add_event("retry_raw_query", origin=origin, destination=destination)
                   route = route_between(origin, destination, profile=profile or "driving")
              else:
                   raise
@@ -489,23 +2532,412 @@ def execute_plan(actions: List[Dict[str, Any]], context: Dict[str, Any] | None =
     executed: List[Dict[str, Any]] = []
     warnings: List[str] = []
 
-    for action in actions:
+    # Normalizamos de una vez todos los textos del plan; execute_action los
+    # encuentra ya calculados.
+    normalize_queries(
+        value
+        for action in actions
+        for name in ("query", "origin", "destination")
+        if isinstance(value := (action.get("params") or {}).get(name), str)
+    )
+
+    for position, action in enumerate(actions):
+        remaining = remaining_time()
+        if remaining is not None and remaining <= 0:
+            # El plazo de la petición se agotó: no seguimos ocupando servicios externos
+            warnings.append(f"Se agotó el tiempo máximo de la consulta; se omitieron {len(actions) - position} acciones.")
+            break
         try:
-            executed.append(execute_action(action, context=context))
+            with trace_span(f"action.{action.get('type')}"):
+                executed.append(execute_action(action, context=context))
         except Exception as exc:  # noqa: BLE001 - capturamos para devolver al cliente
             warnings.append(str(exc))
 
     return executed, warnings
 
 
+# --- Perfilado bajo demanda ---
+# Un administrador abre una ventana de perfilado (duración y fracción de
+# peticiones). La ventana se publica en SHARED_STORE para que la vean todos
+# los procesos; cada uno vuelca sus resultados en un subdirectorio de
+# PROFILE_DIR propio de la ventana y la descarga los combina. Fuera de ventana el coste es comprobar un número por petición.
+
+PROFILER_WINDOW_KEY = "profiler:window"
+PROFILER_WORKER_FILE = re.compile(r"^\d+\.(?:pstats|json)$")
+
+
+class RequestProfiler:
+    def __init__(self, directory: str, interval: float) -> None:
+        self.directory = directory
+        self.interval = interval
+        self._window: Dict[str, float] = {}
+        self._next_poll = 0.0
+        self._lock = threading.Lock()
+        # cProfile solo admite un perfilador activo a la vez por proceso
+        self._cprofile_lock = threading.Lock()
+        self._stats: pstats.Stats | None = None
+        self._collapsed: Dict[str, int] = {}
+        self._threads: Dict[int, int] = {}
+        self._sampler: threading.Thread | None = None
+        self._requests = 0
+        self._dirty = False
+
+    def window(self) -> Dict[str, float]:
+        now = time.monotonic()
+        if now >= self._next_poll:
+            raw = SHARED_STORE.get(PROFILER_WINDOW_KEY)
+            window = json.loads(raw) if raw else {}
+            if window.get("started") != self._window.get("started"):
+                # Ventana nueva (quizá abierta desde otro proceso): empezamos de cero
+                with self._lock:
+                    self._stats, self._collapsed, self._requests, self._dirty = None, {}, 0, False
+            self._window = window
+            self._next_poll = now + 1.0
+        return self._window
+
+    def active(self) -> bool:
+        return self.window().get("until", 0.0) > time.time()
+
+    def window_dir(self, window: Dict[str, float] | None = None) -> str:
+        started = (window if window is not None else self.window()).get("started", 0.0)
+        return os.path.join(self.directory, f"window-{int(started * 1000)}")
+
+    def start_window(self, duration: float, sample_rate: float) -> Dict[str, float]:
+        # Solo se borra lo que escribimos nosotros: ficheros <pid>.pstats/<pid>.json
+        # dentro de los subdirectorios window-*, nunca el resto de PROFILE_DIR.
+        for name in os.listdir(self.directory) if os.path.isdir(self.directory) else []:
+            path = os.path.join(self.directory, name)
+            if not name.startswith("window-") or not os.path.isdir(path):
+                continue
+            for worker_file in os.listdir(path):
+                if PROFILER_WORKER_FILE.match(worker_file):
+                    os.remove(os.path.join(path, worker_file))
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
+        window = {"until": time.time() + duration, "sample_rate": sample_rate, "started": time.time()}
+        SHARED_STORE.set(PROFILER_WINDOW_KEY, json.dumps(window).encode(), duration + 3600)
+        self._next_poll = 0.0
+        return window
+
+    def stop_window(self) -> None:
+        window = dict(self.window(), until=time.time())
+        SHARED_STORE.set(PROFILER_WINDOW_KEY, json.dumps(window).encode(), 3600)
+        self._next_poll = 0.0
+
+    def begin_request(self) -> cProfile.Profile | bool | None:
+        window = self.window()
+        if window.get("until", 0.0) <= time.time() or random.random() >= window.get("sample_rate", 0.0):
+            return None
+        with self._lock:
+            self._threads[threading.get_ident()] = self._threads.get(threading.get_ident(), 0) + 1
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample_loop, name="profiler-sampler", daemon=True)
+                self._sampler.start()
+        if not self._cprofile_lock.acquire(blocking=False):
+            # Otra petición ya usa cProfile: esta solo aporta muestras de pila
+            return True
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def end_request(self, handle: cProfile.Profile | bool) -> None:
+        if isinstance(handle, cProfile.Profile):
+            handle.disable()
+            self._cprofile_lock.release()
+        with self._lock:
+            ident = threading.get_ident()
+            self._threads[ident] -= 1
+            if not self._threads[ident]:
+                del self._threads[ident]
+            if isinstance(handle, cProfile.Profile):
+                if self._stats is None:
+                    self._stats = pstats.Stats(handle)
+                else:
+                    self._stats.add(handle)
+            self._requests += 1
+            self._dirty = True
+
+    def _sample_loop(self) -> None:
+        last_flush = time.monotonic()
+        while True:
+            with self._lock:
+                threads = list(self._threads)
+            frames = sys._current_frames()
+            for ident in threads:
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if stack:
+                    key = ";".join(reversed(stack))
+                    with self._lock:
+                        self._collapsed[key] = self._collapsed.get(key, 0) + 1
+                        self._dirty = True
+            if time.monotonic() - last_flush >= 2.0:
+                self.flush()
+                last_flush = time.monotonic()
+            if not threads and not self.active():
+                self.flush()
+                with self._lock:
+                    self._sampler = None
+                return
+            time.sleep(self.interval)
+
+    def flush(self) -> None:
+        """Vuelca los resultados de este proceso en el directorio de la ventana para combinarlos."""
+        with self._lock:
+            if not self._dirty:
+                return
+            stats = dict(self._stats.stats) if self._stats is not None else {}
+            payload = {"requests": self._requests, "collapsed": dict(self._collapsed)}
+            self._dirty = False
+            directory = self.window_dir(self._window)
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, str(os.getpid()))
+        with open(base + ".pstats", "wb") as handle:
+            marshal.dump(stats, handle)
+        with open(base + ".json", "w", encoding="utf-8") as handle:
+            json.dump(payload, handle)
+
+    def _worker_files(self, suffix: str) -> List[str]:
+        directory = self.window_dir()
+        if not os.path.isdir(directory):
+            return []
+        return [
+            os.path.join(directory, n)
+            for n in sorted(os.listdir(directory))
+            if PROFILER_WORKER_FILE.match(n) and n.endswith(suffix)
+        ]
+
+    def combined_pstats(self) -> bytes:
+        self.flush()
+        combined: pstats.Stats | None = None
+        for path in self._worker_files(".pstats"):
+            if os.path.getsize(path) <= 2:
+                continue
+            if combined is None:
+                combined = pstats.Stats(path)
+            else:
+                combined.add(path)
+        return marshal.dumps(combined.stats if combined is not None else {})
+
+    def combined_collapsed(self) -> str:
+        """Pilas en formato "collapsed" (flamegraph.pl, speedscope, inferno)."""
+        self.flush()
+        totals: Dict[str, int] = {}
+        for path in self._worker_files(".json"):
+            with open(path, encoding="utf-8") as handle:
+                for stack, count in json.load(handle)["collapsed"].items():
+                    totals[stack] = totals.get(stack, 0) + count
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(totals.items()))
+
+    def status(self) -> Dict[str, Any]:
+        self.flush()
+        window = self.window()
+        requests_profiled = 0
+        for path in self._worker_files(".json"):
+            with open(path, encoding="utf-8") as handle:
+                requests_profiled += json.load(handle)["requests"]
+        return {
+            "active": self.active(),
+            "sample_rate": window.get("sample_rate"),
+            "remaining_seconds": max(0.0, round(window.get("until", 0.0) - time.time(), 1)),
+            "requests_profiled": requests_profiled,
+            "workers": len(self._worker_files(".json")),
+        }
+
+
+REQUEST_PROFILER = RequestProfiler(PROFILE_DIR, PROFILE_SAMPLE_INTERVAL)
+
+
+def is_admin_request() -> bool:
+    supplied = request.headers.get("X-Admin-Token", "")
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode())
+
+
+# --- Control de admisión del asistente ---
+# Cada consulta al asistente puede encadenar Gemini, Nominatim y OSRM durante
+# decenas de segundos. Limitamos las que se atienden a la vez en cada proceso,
+# dejamos esperar unas pocas durante poco tiempo y repartimos el ritmo entre
+# clientes con un cubo de fichas en SHARED_STORE; lo demás recibe un 429 rápido.
+
+class AdmissionController:
+    def __init__(self, max_in_flight: int, max_queue: int) -> None:
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self._in_flight = 0
+        self._waiting = 0
+        self._avg_duration = 5.0
+        self._stats = {"admitted": 0, "queued": 0, "rejected": 0, "timed_out": 0}
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout: float) -> bool:
+        with self._cond:
+            if self._in_flight < self.max_in_flight and not self._waiting:
+                self._in_flight += 1
+                self._stats["admitted"] += 1
+                return True
+            if self._waiting >= self.max_queue:
+                self._stats["rejected"] += 1
+                return False
+            self._waiting += 1
+            self._stats["queued"] += 1
+            try:
+                admitted = self._cond.wait_for(lambda: self._in_flight < self.max_in_flight, timeout)
+            finally:
+                self._waiting -= 1
+            if admitted:
+                self._in_flight += 1
+                self._stats["admitted"] += 1
+            else:
+                self._stats["timed_out"] += 1
+            return admitted
+
+    def release(self, duration: float) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            self._avg_duration += 0.2 * (duration - self._avg_duration)
+            self._cond.notify()
+
+    def retry_after(self) -> float:
+        """Estimación de cuándo habrá hueco: lo que tarda de media una tanda de consultas."""
+        with self._cond:
+            backlog = self._waiting + 1
+            return self._avg_duration * backlog / self.max_in_flight
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return dict(
+                self._stats,
+                in_flight=self._in_flight,
+                waiting=self._waiting,
+                avg_duration_s=round(self._avg_duration, 2),
+            )
+
+
+ASSISTANT_ADMISSION = AdmissionController(ASSISTANT_MAX_IN_FLIGHT, ASSISTANT_QUEUE_SIZE)
+
+
+def overloaded_response(message: str, retry_after: float, status: int = 429):
+    seconds = max(1, math.ceil(retry_after))
+    response = jsonify({"error": f"{message} Vuelve a intentarlo en {seconds} s."})
+    response.status_code = status
+    response.headers["Retry-After"] = str(seconds)
+    return response
+
+
+def client_rate_limit(scope: str, per_minute: float, burst: int) -> float:
+    """Cubo de fichas por IP de cliente: 0 si la petición puede seguir, o segundos de espera."""
+    if per_minute <= 0:
+        return 0.0
+    client = request.remote_addr or "unknown"
+    return SHARED_STORE.acquire_token(f"ratelimit:{scope}:{client}", 60.0 / per_minute, burst)
+
+
+def admission_controlled(view):
+    """Aplica el cubo de fichas por cliente, el límite de concurrencia y el plazo de la petición."""
+
+    @functools.wraps(view)
+    def wrapper(*args: Any, **kwargs: Any):
+        wait = client_rate_limit("assistant", ASSISTANT_RATE_PER_MINUTE, ASSISTANT_BURST)
+        if wait > 0:
+            current_span().set_attributes(**{"admission.result": "rate_limited"})
+            return overloaded_response("Has enviado demasiadas consultas seguidas.", wait)
+
+        if not ASSISTANT_ADMISSION.acquire(ASSISTANT_QUEUE_TIMEOUT):
+            current_span().set_attributes(**{"admission.result": "overloaded"})
+            return overloaded_response("El asistente está atendiendo demasiadas consultas.", ASSISTANT_ADMISSION.retry_after())
+
+        started = time.monotonic()
+        try:
+            with request_deadline(ASSISTANT_DEADLINE):
+                return view(*args, **kwargs)
+        finally:
+            ASSISTANT_ADMISSION.release(time.monotonic() - started)
+
+    return wrapper
+
+
+def load_json_file(path: str) -> Dict[str, str]:
+    try:
+        with open(path, encoding="utf-8") as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return {}
+
+
 def create_app() -> Flask:
     app = Flask(__name__)
 
+    # Sin static/dist (build_assets.py no se ha ejecutado) usamos las URLs de CDN
+    vendor_urls = load_json_file(VENDOR_MANIFEST_PATH)
+    asset_manifest = load_json_file(ASSET_MANIFEST_PATH)
+    precompiled_index: Dict[str, Any] = {}
+
+    @app.template_global()
+    def asset_url(name: str) -> str:
+        if name in asset_manifest:
+            return url_for("static", filename=f"dist/{asset_manifest[name]}")
+        return vendor_urls[name]
+
+    @app.after_request
+    def cache_fingerprinted_assets(response):
+        if (
+            request.path.startswith("/static/dist/")
+            and request.path != "/static/dist/manifest.json"
+            and response.status_code in (200, 304)
+        ):
+            # El nombre cambia con el contenido: el navegador no necesita revalidar nunca.
+            # manifest.json conserva su nombre en cada build, así que se revalida.
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+    @app.before_request
+    def start_request_trace():
+        g.trace_span, g.trace_token = start_root_span(
+            f"{request.method} {request.path}", **{"http.method": request.method, "http.target": request.path}
+        )
+        if not request.path.startswith("/api/admin/"):
+            g.profile = REQUEST_PROFILER.begin_request()
+
+    @app.after_request
+    def tag_request_trace(response):
+        span = g.get("trace_span")
+        if span is not None and span.trace_id:
+            span.set_attributes(**{"http.status_code": response.status_code})
+            response.headers["X-Trace-Id"] = span.trace_id
+        return response
+
+    @app.teardown_request
+    def finish_request_trace(exc):
+        profile = g.pop("profile", None)
+        if profile is not None:
+            REQUEST_PROFILER.end_request(profile)
+        span = g.pop("trace_span", None)
+        if span is not None:
+            if exc is not None:
+                span.record_error(exc)
+            finish_root_span(span, g.pop("trace_token"))
+
     @app.route("/")
     def index():
-        return render_template("index.html")
+        # La página no depende de la petición: se renderiza una vez y se sirve
+        # con ETag (en modo debug se vuelve a renderizar para ver los cambios).
+        if "body" not in precompiled_index or app.debug:
+            precompiled_index["body"] = render_template(
+                "index.html", autocomplete_enabled=bool(AUTOCOMPLETE_ENDPOINT)
+            ).encode("utf-8")
+        response = app.response_class(precompiled_index["body"], mimetype="text/html")
+        response.headers["Cache-Control"] = "no-cache"
+        response.add_etag()
+        return response.make_conditional(request)
 
     @app.post("/api/assistant")
+    @admission_controlled
     def assistant():
         payload = request.get_json(silent=True) or {}
         prompt = (payload.get("prompt") or "").strip()
@@ -515,11 +2947,18 @@ def create_app() -> Flask:
         history = payload.get("history")
         context = payload.get("context") # Map context (viewbox, center)
 
+        # Adelantamos las geocodificaciones evidentes mientras el modelo planifica
+        GEOCODE_PREFETCHER.schedule(prompt, context)
+
         try:
-            plan = request_plan_from_gemini(prompt, history=history)
+            with trace_span("gemini.plan", model=GEMINI_MODEL) as span:
+                plan = request_plan_from_gemini(prompt, history=history)
+                span.set_attributes(actions=len(plan.get("actions", [])))
             executed_actions, warnings = execute_plan(plan.get("actions", []), context=context)
         except AssistantPlanningError as exc:
             return jsonify({"error": str(exc)}), 502
+        except UpstreamBusy as exc:
+            return overloaded_response(str(exc), exc.retry_after, status=503)
         except RuntimeError as exc:
             return jsonify({"error": str(exc)}), 503
         except ValueError as exc:
@@ -527,6 +2966,8 @@ def create_app() -> Flask:
         except requests.HTTPError as exc:
             status = exc.response.status_code if exc.response else 502
             return jsonify({"error": f"Error HTTP externo: {exc}"}), status
+        except DeadlineExceeded as exc:
+            return jsonify({"error": str(exc)}), 504
         except requests_exceptions.RequestException as exc:
             return jsonify({"error": f"Error de red con servicios externos: {exc}"}), 502
         except Exception as exc:  # noqa: BLE001
@@ -562,6 +3003,162 @@ def create_app() -> Flask:
 
         return jsonify(response_body)
 
+    @app.get("/api/geocode")
+    def geocode():
+        # Las búsquedas manuales del navegador pasan por la misma caché y el mismo
+        # ritmo compartido hacia Nominatim que las del asistente.
+        query = (request.args.get("q") or "").strip()
+        if not query:
+            return jsonify({"error": "La consulta no puede estar vacía."}), 400
+        viewbox = request.args.get("viewbox") or None
+        autocomplete = request.args.get("autocomplete") == "1"
+        if autocomplete and not AUTOCOMPLETE_ENDPOINT:
+            return jsonify({"error": "El autocompletado no está configurado en este servidor."}), 404
+
+        wait = client_rate_limit("geocode", GEOCODE_RATE_PER_MINUTE, GEOCODE_BURST)
+        if wait > 0:
+            return overloaded_response("Has enviado demasiadas búsquedas seguidas.", wait)
+
+        try:
+            if autocomplete:
+                if len(query) < AUTOCOMPLETE_MIN_CHARS:
+                    results: List[Dict[str, Any]] = []
+                else:
+                    limit = min(max(request.args.get("limit", default=AUTOCOMPLETE_LIMIT, type=int), 1), 10)
+                    results = autocomplete_places(query, limit=limit, viewbox=viewbox)
+                response = jsonify({"query": query, "results": results})
+            else:
+                include_polygon = request.args.get("polygon") == "1"
+                response = jsonify(geocode_place(query, include_polygon=include_polygon, viewbox=viewbox))
+        except UpstreamBusy as exc:
+            return overloaded_response(str(exc), exc.retry_after, status=503)
+        except ValueError as exc:
+            return jsonify({"error": str(exc)}), 404
+        except requests_exceptions.RequestException as exc:
+            return jsonify({"error": f"Error de red con servicios externos: {exc}"}), 502
+
+        response.headers["Cache-Control"] = "private, max-age=300"
+        return response
+
+    @app.get("/api/geometry/<osm_type>/<int:osm_id>")
+    def geometry(osm_type: str, osm_id: int):
+        osm_type = osm_type.lower()
+        if osm_type not in OSM_TYPE_CODES:
+            return jsonify({"error": f"Tipo OSM desconocido: {osm_type}"}), 400
+        zoom = request.args.get("zoom", type=int)
+        if zoom is not None:
+            # A partir de zoom 18 servimos la geometría completa
+            zoom = max(0, zoom) if zoom < 18 else None
+
+        wait = client_rate_limit("geometry", GEOMETRY_RATE_PER_MINUTE, GEOMETRY_BURST)
+        if wait > 0:
+            return overloaded_response("Has pedido demasiados contornos seguidos.", wait)
+
+        binary = request.args.get("format") == "binary"
+        try:
+            if binary:
+                body = geometry_binary_body(osm_type, osm_id, zoom)
+            else:
+                body = simplified_geometry_body(osm_type, osm_id, zoom)
+        except UpstreamBusy as exc:
+            return overloaded_response(str(exc), exc.retry_after, status=503)
+        except ValueError as exc:
+            return jsonify({"error": str(exc)}), 404
+        except requests_exceptions.RequestException as exc:
+            return jsonify({"error": f"Error de red con servicios externos: {exc}"}), 502
+
+        response = app.response_class(body, mimetype="application/octet-stream" if binary else "application/json")
+        response.headers["Cache-Control"] = f"public, max-age={GEOMETRY_CACHE_TTL}"
+        response.add_etag()
+        return response.make_conditional(request)
+
+    @app.get("/api/osrm/route/v1/<profile>/<coordinates>")
+    def osrm_route(profile: str, coordinates: str):
+        # Compatible con el API de OSRM para usarlo como serviceUrl de Leaflet
+        # Routing Machine: las rutas ya calculadas por el asistente salen de caché.
+        try:
+            points = parse_osrm_coordinates(coordinates)
+        except ValueError as exc:
+            return jsonify({"code": "InvalidQuery", "message": str(exc)}), 400
+        # También cuentan las rutas ya en caché: arrastrar un punto genera una petición por suelta
+        wait = client_rate_limit("osrm", OSRM_RATE_PER_MINUTE, OSRM_BURST)
+        if wait > 0:
+            response = overloaded_response("Has pedido demasiadas rutas seguidas.", wait)
+            response.set_data(json.dumps({"code": "TooManyRequests", "message": "Has pedido demasiadas rutas seguidas."}))
+            return response
+        try:
+            data = fetch_osrm_route(profile, points)
+        except OSRMResponseError as exc:
+            return jsonify(exc.payload), exc.status_code
+        except UpstreamBusy as exc:
+            response = overloaded_response(str(exc), exc.retry_after, status=503)
+            response.set_data(json.dumps({"code": "TooBusy", "message": str(exc)}))
+            return response
+        except requests_exceptions.RequestException as exc:
+            return jsonify({"code": "BackendError", "message": f"Error de red con servicios externos: {exc}"}), 502
+
+        response = jsonify(osrm_client_response(data, request.args.to_dict()))
+        response.headers["Cache-Control"] = "private, max-age=300"
+        return response
+
+    @app.route("/api/admin/profiler", methods=["GET", "POST", "DELETE"])
+    def profiler():
+        if not is_admin_request():
+            return jsonify({"error": "No encontrado."}), 404
+        if request.method == "POST":
+            payload = request.get_json(silent=True) or {}
+            try:
+                duration = min(max(float(payload.get("duration", 60)), 1.0), 3600.0)
+                sample_rate = min(max(float(payload.get("sample_rate", 0.1)), 0.0), 1.0)
+            except (TypeError, ValueError):
+                return jsonify({"error": "'duration' y 'sample_rate' deben ser numéricos."}), 400
+            REQUEST_PROFILER.start_window(duration, sample_rate)
+        elif request.method == "DELETE":
+            REQUEST_PROFILER.stop_window()
+        return jsonify(REQUEST_PROFILER.status())
+
+    @app.get("/api/admin/profiler/download")
+    def profiler_download():
+        if not is_admin_request():
+            return jsonify({"error": "No encontrado."}), 404
+        if request.args.get("format", "pstats") == "collapsed":
+            response = app.response_class(REQUEST_PROFILER.combined_collapsed(), mimetype="text/plain")
+            filename = "profile.collapsed.txt"
+        else:
+            response = app.response_class(REQUEST_PROFILER.combined_pstats(), mimetype="application/octet-stream")
+            filename = "profile.pstats"
+        response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+        return response
+
+    @app.get("/api/search/<result_id>/clusters")
+    def search_clusters(result_id: str):
+        cached = SEARCH_RESULTS_CACHE.get(result_id)
+        if cached is None:
+            return jsonify({"error": "La búsqueda ha caducado; repítela."}), 404
+        points = cached["points"]
+        zoom = request.args.get("zoom", default=12, type=int)
+        return jsonify({
+            "result_id": result_id,
+            "total": len(points),
+            "truncated": cached["truncated"],
+            "zoom": zoom,
+            "clusters": cluster_points(points, zoom, request.args.get("bbox")),
+        })
+
+    @app.get("/api/metrics")
+    def metrics():
+        return jsonify({
+            "geocode_cache": GEOCODE_CACHE.stats(),
+            "route_cache": ROUTE_CACHE.stats(),
+            "autocomplete_cache": AUTOCOMPLETE_CACHE.stats(),
+            "prefetch": GEOCODE_PREFETCHER.stats(),
+            "assistant_admission": ASSISTANT_ADMISSION.stats(),
+            "geometry_store": GEOMETRY_STORE.stats(),
+            "simplified_geometry_cache": SIMPLIFIED_GEOMETRY_CACHE.stats(),
+            "shared_backend": SHARED_CACHE_URL.split(":", 1)[0],
+            "tracing": TRACE_EXPORTER.stats(),
+        })
+
     return app
 
 
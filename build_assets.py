@@ -0,0 +1,107 @@
+import hashlib
+import json
+import re
+import shutil
+import sys
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+
+import requests
+
+# --- Configuration ---
+PROJECT_DIR = Path(__file__).parent.absolute()
+VENDOR_FILE = PROJECT_DIR / "static" / "vendor.json"
+DIST_DIR = PROJECT_DIR / "static" / "dist"
+MANIFEST_FILE = DIST_DIR / "manifest.json"
+
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+CSS_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+
+
+def fingerprint(name, content):
+    """'leaflet.css' -> 'leaflet.3f2a9c1b7d.css' (hash del contenido)."""
+    digest = hashlib.sha256(content).hexdigest()[:10]
+    stem, dot, ext = name.rpartition(".")
+    return f"{stem}.{digest}.{ext}" if dot else f"{name}.{digest}"
+
+
+def publish(name, content):
+    filename = fingerprint(name, content)
+    (DIST_DIR / filename).write_bytes(content)
+    print(f"[OK] {name} -> static/dist/{filename}")
+    return filename
+
+
+def minify_css(text):
+    text = CSS_COMMENT.sub("", text)
+    text = re.sub(r"\s+", " ", text)
+    text = re.sub(r"\s*([{};,])\s*", r"\1", text)
+    text = re.sub(r":\s+", ":", text)
+    return text.replace(";}", "}").strip()
+
+
+def minify_js(text, url):
+    if ".min." in url:
+        return text
+    try:
+        import rjsmin
+    except ImportError:
+        # Sin rjsmin publicamos el fichero tal cual (la mayoría ya viene minificado)
+        return text
+    return rjsmin.jsmin(text)
+
+
+def build_css(session, name, url, published):
+    """Publica una hoja de estilos y todos los recursos relativos que referencia."""
+    response = session.get(url, timeout=30)
+    response.raise_for_status()
+    text = response.text
+
+    def rewrite(match):
+        reference = match.group(2).strip()
+        if reference.startswith(("data:", "http:", "https:", "#", "/")):
+            return match.group(0)
+        parts = urlsplit(reference)
+        absolute = urljoin(url, parts.path)
+        if absolute not in published:
+            response = session.get(absolute, timeout=30)
+            response.raise_for_status()
+            published[absolute] = publish(Path(parts.path).name, response.content)
+        suffix = (f"?{parts.query}" if parts.query else "") + (f"#{parts.fragment}" if parts.fragment else "")
+        return f'url("{published[absolute]}{suffix}")'
+
+    return minify_css(CSS_URL.sub(rewrite, text)).encode("utf-8")
+
+
+def build_assets():
+    vendor = json.loads(VENDOR_FILE.read_text(encoding="utf-8"))
+    if DIST_DIR.exists():
+        shutil.rmtree(DIST_DIR)
+    DIST_DIR.mkdir(parents=True)
+
+    session = requests.Session()
+    manifest = {}
+    published = {}
+    for name, url in vendor.items():
+        print(f"[INFO] Descargando {url}")
+        if name.endswith(".css"):
+            content = build_css(session, name, url, published)
+        else:
+            response = session.get(url, timeout=30)
+            response.raise_for_status()
+            content = response.content
+            if name.endswith(".js"):
+                content = minify_js(response.text, url).encode("utf-8")
+        manifest[name] = publish(name, content)
+
+    MANIFEST_FILE.write_text(json.dumps(manifest, indent=2, sort_keys=True), encoding="utf-8")
+    print(f"[OK] Manifiesto escrito en: {MANIFEST_FILE}")
+
+
+if __name__ == "__main__":
+    try:
+        build_assets()
+        print("\n[ÉXITO] Recursos estáticos generados. Reinicia el servidor para usarlos.")
+    except Exception as e:
+        print(f"\n[ERROR] {e}")
+        sys.exit(1)
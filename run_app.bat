@@ -30,6 +30,15 @@ if errorlevel 1 (
     exit /b 1
 )
 
+rem Solo la primera vez: build_assets.py borra static\dist antes de descargar
+if not exist "%PROJECT_DIR%static\dist\manifest.json" (
+    echo [INFO] Publicando recursos del frontend en static\dist...
+    python "%PROJECT_DIR%build_assets.py"
+    if errorlevel 1 (
+        echo [AVISO] No se pudieron publicar los recursos; la pagina usara los CDN.
+    )
+)
+
 echo [INFO] Iniciando servidor Flask...
 start http://127.0.0.1:5000
 flask --app app --debug run
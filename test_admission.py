@@ -0,0 +1,109 @@
+import os
+import tempfile
+import threading
+import time
+
+# Caché compartida y almacén de geometrías en memoria: importar app no escribe en
+# .cache/ (la prueba del almacén SQLite usa un directorio temporal)
+os.environ["SHARED_CACHE_URL"] = "memory://"
+os.environ["GEOMETRY_STORE_DIR"] = ""
+
+from app import (
+    AdmissionController,
+    DeadlineExceeded,
+    MemorySharedStore,
+    SQLiteSharedStore,
+    remaining_time,
+    request_deadline,
+    upstream_timeout,
+)
+
+
+def stores():
+    yield MemorySharedStore()
+    with tempfile.TemporaryDirectory() as directory:
+        yield SQLiteSharedStore(os.path.join(directory, "shared.sqlite3"))
+
+
+def test_burst_then_wait():
+    for store in stores():
+        # Una ficha por minuto y ráfagas de 3: las tres primeras pasan
+        assert [store.acquire_token("client", 60.0, 3) for _ in range(3)] == [0.0, 0.0, 0.0]
+        wait = store.acquire_token("client", 60.0, 3)
+        assert 59.0 < wait <= 60.0, (store, wait)
+        # Una petición rechazada no consume ficha
+        assert store.acquire_token("client", 60.0, 3) <= wait
+
+
+def test_clients_are_independent():
+    for store in stores():
+        assert store.acquire_token("a", 60.0, 1) == 0.0
+        assert store.acquire_token("a", 60.0, 1) > 0
+        assert store.acquire_token("b", 60.0, 1) == 0.0
+
+
+def test_tokens_refill():
+    for store in stores():
+        assert store.acquire_token("fast", 0.01, 1) == 0.0
+        wait = store.acquire_token("fast", 0.01, 1)
+        assert 0 < wait <= 0.01
+        time.sleep(wait + 0.005)
+        assert store.acquire_token("fast", 0.01, 1) == 0.0
+
+
+def test_admission_queue_and_reject():
+    controller = AdmissionController(max_in_flight=1, max_queue=1)
+    assert controller.acquire(0.1)
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(controller.acquire(2.0)))
+    waiter.start()
+    while controller.stats()["waiting"] == 0:
+        time.sleep(0.001)
+    # Cola llena: se rechaza sin esperar
+    started = time.monotonic()
+    assert not controller.acquire(2.0)
+    assert time.monotonic() - started < 0.5
+    controller.release(1.0)
+    waiter.join()
+    assert results == [True]
+    stats = controller.stats()
+    assert (stats["admitted"], stats["queued"], stats["rejected"], stats["in_flight"]) == (2, 1, 1, 1)
+
+
+def test_admission_timeout_and_retry_after():
+    controller = AdmissionController(max_in_flight=2, max_queue=4)
+    assert controller.acquire(0.1) and controller.acquire(0.1)
+    assert not controller.acquire(0.05)
+    assert controller.stats()["timed_out"] == 1
+    # Media móvil de la duración: 5 s iniciales, 20 % hacia cada nueva medida
+    controller.release(10.0)
+    assert controller.stats()["avg_duration_s"] == 6.0
+    assert controller.retry_after() == 6.0 / 2
+
+
+def test_deadline_helpers():
+    assert remaining_time() is None
+    assert upstream_timeout(15) == 15
+    with request_deadline(5):
+        assert 4.9 < remaining_time() <= 5
+        assert upstream_timeout(15) <= 5
+        assert upstream_timeout(2) == 2
+    with request_deadline(0.05):
+        time.sleep(0.06)
+        try:
+            upstream_timeout(15)
+        except DeadlineExceeded:
+            pass
+        else:
+            raise AssertionError("upstream_timeout debería agotar el plazo")
+    assert remaining_time() is None
+
+
+if __name__ == "__main__":
+    test_burst_then_wait()
+    test_clients_are_independent()
+    test_tokens_refill()
+    test_admission_queue_and_reject()
+    test_admission_timeout_and_retry_after()
+    test_deadline_helpers()
+    print("OK")
@@ -0,0 +1,53 @@
+import os
+
+# Caché compartida y almacén de geometrías en memoria: importar app no escribe en .cache/
+os.environ["SHARED_CACHE_URL"] = "memory://"
+os.environ["GEOMETRY_STORE_DIR"] = ""
+
+from app import CLUSTER_MAX_ZOOM, cluster_points
+
+# Dos farmacias a unos 100 m en Madrid y una en Barcelona
+POINTS = [
+    {"displayName": "Farmacia Sol", "lat": 40.4168, "lon": -3.7038},
+    {"displayName": "Farmacia Mayor", "lat": 40.4160, "lon": -3.7050},
+    {"displayName": "Farmacia Rambla", "lat": 41.3809, "lon": 2.1734},
+]
+
+
+def test_nearby_points_are_grouped():
+    clusters = cluster_points(POINTS, zoom=5)
+    groups = [c for c in clusters if c["type"] == "cluster"]
+    singles = [c for c in clusters if c["type"] == "point"]
+    assert len(groups) == 1 and len(singles) == 1
+    group = groups[0]
+    assert group["count"] == 2
+    assert abs(group["lat"] - 40.4164) < 1e-6 and abs(group["lon"] - -3.7044) < 1e-6
+    # [sur, norte, oeste, este], como los bounding_box de Nominatim
+    assert group["bounding_box"] == [40.416, 40.4168, -3.705, -3.7038]
+    # Al ampliar hasta expansion_zoom el grupo se separa
+    assert 5 < group["expansion_zoom"] <= CLUSTER_MAX_ZOOM
+    assert len(cluster_points(POINTS, zoom=group["expansion_zoom"])) == 3
+    assert singles[0]["displayName"] == "Farmacia Rambla"
+
+
+def test_counts_are_preserved_at_every_zoom():
+    for zoom in range(0, CLUSTER_MAX_ZOOM + 2):
+        clusters = cluster_points(POINTS, zoom=zoom)
+        assert sum(c.get("count", 1) for c in clusters) == len(POINTS), zoom
+    # Por encima del zoom máximo nunca se agrupa
+    assert all(c["type"] == "point" for c in cluster_points(POINTS, zoom=CLUSTER_MAX_ZOOM + 5))
+
+
+def test_viewbox_filters_points():
+    # "oeste,norte,este,sur", como lo envía el cliente
+    madrid = cluster_points(POINTS, zoom=3, viewbox="-4.0,40.6,-3.5,40.2")
+    assert [c.get("count", 1) for c in madrid] == [2]
+    assert cluster_points(POINTS, zoom=3, viewbox="10,50,11,49") == []
+    assert cluster_points([], zoom=3) == []
+
+
+if __name__ == "__main__":
+    test_nearby_points_are_grouped()
+    test_counts_are_preserved_at_every_zoom()
+    test_viewbox_filters_points()
+    print("OK")
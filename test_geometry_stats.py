@@ -0,0 +1,88 @@
+import os
+
+# Caché compartida y almacén de geometrías en memoria: importar app no escribe en .cache/
+os.environ["SHARED_CACHE_URL"] = "memory://"
+os.environ["GEOMETRY_STORE_DIR"] = ""
+
+from app import geometry_stats
+
+SQUARE = [[0.0, 0.0], [0.01, 0.0], [0.01, 0.01], [0.0, 0.01], [0.0, 0.0]]
+HOLE = [[0.0025, 0.0025], [0.0075, 0.0025], [0.0075, 0.0075], [0.0025, 0.0075], [0.0025, 0.0025]]
+# Lado de 0.01° en el ecuador: ~1113 m
+SIDE_M = 1113.2
+
+
+def close(value, expected, tolerance=0.01):
+    return abs(value - expected) <= abs(expected) * tolerance
+
+
+def test_square():
+    stats = geometry_stats({"type": "Polygon", "coordinates": [SQUARE]})
+    assert close(stats["area_m2"], SIDE_M ** 2), stats
+    assert close(stats["perimeter_m"], 4 * SIDE_M), stats
+    assert stats["centroid"] == [0.005, 0.005]
+    # [sur, norte, oeste, este], como el boundingbox de Nominatim
+    assert stats["bbox"] == [0.0, 0.01, 0.0, 0.01]
+
+
+def test_orientation_does_not_matter():
+    clockwise = geometry_stats({"type": "Polygon", "coordinates": [SQUARE[::-1]]})
+    counter = geometry_stats({"type": "Polygon", "coordinates": [SQUARE]})
+    assert clockwise["area_m2"] == counter["area_m2"]
+
+
+def test_hole_is_subtracted():
+    full = geometry_stats({"type": "Polygon", "coordinates": [SQUARE]})
+    holed = geometry_stats({"type": "Polygon", "coordinates": [SQUARE, HOLE]})
+    assert close(holed["area_m2"], full["area_m2"] * 0.75), holed
+    # El perímetro incluye el del hueco
+    assert close(holed["perimeter_m"], full["perimeter_m"] * 1.5), holed
+    assert holed["centroid"] == [0.005, 0.005]
+
+
+def test_multipolygon_sums_parts():
+    single = geometry_stats({"type": "Polygon", "coordinates": [SQUARE]})
+    shifted = [[lon + 0.02, lat] for lon, lat in SQUARE]
+    multi = geometry_stats({"type": "MultiPolygon", "coordinates": [[SQUARE], [shifted]]})
+    assert close(multi["area_m2"], 2 * single["area_m2"]), multi
+    assert multi["bbox"] == [0.0, 0.01, 0.0, 0.03]
+
+
+def test_other_types():
+    assert geometry_stats(None) is None
+    assert geometry_stats({"type": "Point", "coordinates": [0, 0]}) is None
+    assert geometry_stats({"type": "LineString", "coordinates": SQUARE}) is None
+    # Anillos degenerados (menos de 4 puntos una vez cerrados)
+    assert geometry_stats({"type": "Polygon", "coordinates": [SQUARE[:2]]}) is None
+
+
+def test_centroid_is_lat_lon():
+    # Rectángulo asimétrico: 0.04° de ancho (lon) por 0.01° de alto (lat)
+    wide = [[10.0, 40.0], [10.04, 40.0], [10.04, 40.01], [10.0, 40.01], [10.0, 40.0]]
+    stats = geometry_stats({"type": "Polygon", "coordinates": [wide]})
+    assert stats["centroid"] == [40.005, 10.02], stats
+    assert stats["bbox"] == [40.0, 40.01, 10.0, 10.04], stats
+
+
+def test_empty_rings_are_skipped():
+    assert geometry_stats({"type": "Polygon", "coordinates": [[]]}) is None
+    full = geometry_stats({"type": "Polygon", "coordinates": [SQUARE]})
+    assert geometry_stats({"type": "Polygon", "coordinates": [SQUARE, []]}) == full
+    assert geometry_stats({"type": "MultiPolygon", "coordinates": [[[]], [SQUARE]]}) == full
+
+
+def test_open_ring_is_closed():
+    triangle = geometry_stats({"type": "Polygon", "coordinates": [SQUARE[:3]]})
+    assert close(triangle["area_m2"], SIDE_M ** 2 / 2), triangle
+
+
+if __name__ == "__main__":
+    test_square()
+    test_orientation_does_not_matter()
+    test_hole_is_subtracted()
+    test_multipolygon_sums_parts()
+    test_other_types()
+    test_centroid_is_lat_lon()
+    test_empty_rings_are_skipped()
+    test_open_ring_is_closed()
+    print("OK")
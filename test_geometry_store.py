@@ -0,0 +1,109 @@
+import os
+import tempfile
+
+# Caché compartida y almacén de geometrías en memoria: importar app no escribe en .cache/
+os.environ["SHARED_CACHE_URL"] = "memory://"
+os.environ["GEOMETRY_STORE_DIR"] = ""
+
+import app
+from app import GeometryStore
+
+SQUARE = {"type": "Polygon", "coordinates": [[[2.3, 48.8], [2.4, 48.8], [2.4, 48.9], [2.3, 48.9], [2.3, 48.8]]]}
+
+
+# Un anillo de muchos vértices, para que su registro ocupe la mayor parte del fichero
+CIRCLE = {"type": "Polygon", "coordinates": [[[2.3 + i * 1e-4, 48.8 + (i % 7) * 1e-4] for i in range(2000)] + [[2.3, 48.8]]]}
+
+
+class FakeResponse:
+    status_code = 200
+    ok = True
+    headers = {}
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        pass
+
+
+def test_geometry_endpoint_looks_up_once_and_limits_clients():
+    lookups = []
+
+    def fake_nominatim(method, url, **kwargs):
+        lookups.append(kwargs["params"]["osm_ids"])
+        return FakeResponse([{"display_name": "Paris", "boundingbox": ["48.8", "48.9", "2.3", "2.4"], "geojson": SQUARE}])
+
+    original = (app.requests.request, app.NOMINATIM_MIN_INTERVAL, app.GEOMETRY_BURST)
+    app.requests.request = fake_nominatim
+    app.NOMINATIM_MIN_INTERVAL, app.GEOMETRY_BURST = 0, 3
+    try:
+        client = app.create_app().test_client()
+        env = {"REMOTE_ADDR": "192.0.2.10"}
+        responses = [client.get("/api/geometry/relation/7444?zoom=12", environ_base=env) for _ in range(3)]
+        assert [response.status_code for response in responses] == [200, 200, 200]
+        # Las siguientes salen del almacén: un solo /lookup
+        assert lookups == ["R7444"]
+        body = responses[0].get_json()
+        assert body["geojson"]["type"] == "Polygon" and body["zoom"] == 12
+        limited = client.get("/api/geometry/relation/7444", environ_base=env)
+        assert limited.status_code == 429
+        assert int(limited.headers["Retry-After"]) >= 1
+    finally:
+        app.requests.request, app.NOMINATIM_MIN_INTERVAL, app.GEOMETRY_BURST = original
+
+
+def test_store_put_get_and_dedupe():
+    with tempfile.TemporaryDirectory() as directory:
+        store = GeometryStore(directory, ttl=60)
+        assert store.get("relation", 7444) is None
+        assert store.put("relation", 7444, SQUARE, {"displayName": "Paris"})
+        size = os.path.getsize(store.data_path)
+        # Otra consulta con el mismo objeto no vuelve a anexar el registro
+        assert store.put("relation", 7444, SQUARE, {"displayName": "Paris"})
+        assert os.path.getsize(store.data_path) == size
+        meta, record = store.get("relation", 7444)
+        assert meta == {"displayName": "Paris"}
+        assert app.record_to_geojson(record) == SQUARE
+        # Los puntos no se guardan
+        assert not store.put("node", 1, {"type": "Point", "coordinates": [2.3, 48.8]}, {})
+
+
+def test_store_compacts_expired_records():
+    with tempfile.TemporaryDirectory() as directory:
+        store = GeometryStore(directory, ttl=60)
+        store.COMPACT_MIN_BYTES = 0
+        store.put("way", 1, CIRCLE, {})
+        store.put("relation", 7444, SQUARE, {})
+        assert store.get("way", 1) is not None
+        # El contorno grande caduca: la siguiente escritura compacta el fichero
+        store._connect().execute("UPDATE geometries SET created = 0 WHERE key = 'way/1'")
+        store.put("relation", 5, SQUARE, {})
+        assert store.data_path.endswith("geometries.1.bin")
+        assert not os.path.exists(os.path.join(directory, "geometries.bin"))
+        assert store.get("way", 1) is None
+        assert app.record_to_geojson(store.get("relation", 7444)[1]) == SQUARE
+        assert app.record_to_geojson(store.get("relation", 5)[1]) == SQUARE
+        # Otra instancia (otro proceso) lee la generación nueva
+        assert GeometryStore(directory, ttl=60).get("relation", 5) is not None
+
+
+def test_cached_place_points_at_geometry_url():
+    key = app.geocode_cache_key("Paris", include_polygon=True)
+    place = {"query": "Paris", "lat": 48.85, "lon": 2.35, "osm_type": "relation", "osm_id": 7444, "geojson": SQUARE}
+    app.cache_place(key, place)
+    cached = app.attach_stored_geometry(app.GEOCODE_CACHE.get(key))
+    # El contorno no se vuelve a inflar en cada acierto: se pide a /api/geometry
+    assert cached["geojson"] is None and "geometry_ref" not in cached
+    assert cached["geometry_url"] == "/api/geometry/relation/7444"
+
+
+if __name__ == "__main__":
+    test_geometry_endpoint_looks_up_once_and_limits_clients()
+    test_store_put_get_and_dedupe()
+    test_store_compacts_expired_records()
+    test_cached_place_points_at_geometry_url()
+    print("OK")
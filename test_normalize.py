@@ -0,0 +1,56 @@
+import os
+
+# Caché compartida y almacén de geometrías en memoria: importar app no escribe en .cache/
+os.environ["SHARED_CACHE_URL"] = "memory://"
+os.environ["GEOMETRY_STORE_DIR"] = ""
+
+from app import clean_search_query, geocode_cache_key, normalize_query
+
+# (consulta, texto que se envía a Nominatim)
+ARRONDISSEMENTS = [
+    ("Distrito 5 de París", "Paris 5e Arrondissement"),
+    ("distrito IV de Paris", "Paris 4e Arrondissement"),
+    ("5e arrondissement de Paris", "Paris 5e Arrondissement"),
+    ("París 5º distrito", "Paris 5e Arrondissement"),
+    ("Paris 5e", "Paris 5e Arrondissement"),
+    ("Paris 1er", "Paris 1er Arrondissement"),
+    ("Paris XVIe arrondissement", "Paris 16e Arrondissement"),
+    # Sin ordinal ni "arrondissement" no es un distrito
+    ("Paris vie", "Paris vie"),
+    ("Paris 75", "Paris 75"),
+    ("10 Rue de Buci, Paris", "10 Rue de Buci, Paris"),
+    ("Distrito 25 de París", "Distrito 25 de París"),
+]
+
+
+def test_arrondissements():
+    for query, expected in ARRONDISSEMENTS:
+        assert clean_search_query(query) == expected, (query, clean_search_query(query))
+
+
+def test_noise_removal():
+    assert clean_search_query("Localiza el Museo del Prado en Madrid") == "Museo del Prado Madrid"
+    assert clean_search_query("  Marca la   Puerta del Sol  ") == "Puerta del Sol"
+    assert clean_search_query("desde Sol") == "Sol"
+    assert clean_search_query("") == ""
+
+
+def test_particles_are_kept():
+    # Nombres distintos no pueden compartir clave de caché
+    pairs = [("El Salvador", "Salvador"), ("La Paz", "Paz"), ("Rue de Buci, Paris", "Rue Buci, Paris")]
+    for first, second in pairs:
+        assert normalize_query(first).key != normalize_query(second).key, (first, second)
+
+
+def test_equivalent_spellings_share_key():
+    assert normalize_query("Museo del Prado, Madrid").key == normalize_query("museo del prado ,madrid").key
+    assert normalize_query("París").key == normalize_query("PARIS").key
+    assert geocode_cache_key("Museo  del Prado", True, None) == geocode_cache_key("museo del prado", True, "")
+
+
+if __name__ == "__main__":
+    test_arrondissements()
+    test_noise_removal()
+    test_particles_are_kept()
+    test_equivalent_spellings_share_key()
+    print("OK")
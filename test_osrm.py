@@ -0,0 +1,87 @@
+import os
+
+# Caché compartida y almacén de geometrías en memoria: importar app no escribe en .cache/
+os.environ["SHARED_CACHE_URL"] = "memory://"
+os.environ["GEOMETRY_STORE_DIR"] = ""
+
+import app
+from app import encode_polyline
+
+ROUTE = {
+    "code": "Ok",
+    "waypoints": [],
+    "routes": [{
+        "distance": 1200.0,
+        "duration": 300.0,
+        "geometry": {"type": "LineString", "coordinates": [[-120.2, 38.5], [-120.95, 40.7], [-126.453, 43.252]]},
+        "legs": [],
+    }],
+}
+
+
+class FakeResponse:
+    status_code = 200
+    ok = True
+    headers = {}
+
+    def json(self):
+        return ROUTE
+
+    def raise_for_status(self):
+        pass
+
+
+def test_reference_example():
+    # Ejemplo de la documentación del formato (coordenadas GeoJSON [lon, lat])
+    coords = [[-120.2, 38.5], [-120.95, 40.7], [-126.453, 43.252]]
+    assert encode_polyline(coords) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+
+def test_precision_6():
+    # polyline6 (geometries=polyline6 de OSRM): mismo algoritmo con factor 1e6
+    assert encode_polyline([[0.000001, 0.000001]], precision=6) == "AA"
+    assert encode_polyline([[0.00001, 0.00001]], precision=5) == "AA"
+
+
+def test_repeated_points_and_empty():
+    assert encode_polyline([]) == ""
+    assert encode_polyline([[2.35, 48.85], [2.35, 48.85]]).endswith("??")
+
+
+def test_proxy_caches_and_limits_clients():
+    calls = []
+
+    def fake_request(method, url, **kwargs):
+        calls.append(url)
+        return FakeResponse()
+
+    original = (app.OSRM_SESSION.request, app.OSRM_MIN_INTERVAL, app.OSRM_BURST)
+    app.OSRM_SESSION.request = fake_request
+    app.OSRM_MIN_INTERVAL, app.OSRM_BURST = 0, 2
+    try:
+        client = app.create_app().test_client()
+        url = "/api/osrm/route/v1/driving/-120.2,38.5;-126.453,43.252"
+        env = {"REMOTE_ADDR": "192.0.2.1"}
+        first = client.get(url + "?geometries=geojson", environ_base=env)
+        second = client.get(url + "?overview=full", environ_base=env)
+        assert first.status_code == second.status_code == 200
+        # La segunda sale de ROUTE_CACHE, adaptada a polyline
+        assert len(calls) == 1
+        assert second.get_json()["routes"][0]["geometry"] == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+        limited = client.get(url, environ_base=env)
+        assert limited.status_code == 429
+        assert limited.get_json()["code"] == "TooManyRequests"
+        assert int(limited.headers["Retry-After"]) >= 1
+        # Otro cliente tiene su propio cubo
+        assert client.get(url, environ_base={"REMOTE_ADDR": "192.0.2.2"}).status_code == 200
+    finally:
+        app.OSRM_SESSION.request, app.OSRM_MIN_INTERVAL, app.OSRM_BURST = original
+
+
+if __name__ == "__main__":
+    test_reference_example()
+    test_precision_6()
+    test_repeated_points_and_empty()
+    test_proxy_caches_and_limits_clients()
+    print("OK")
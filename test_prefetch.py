@@ -0,0 +1,209 @@
+import os
+import threading
+import time
+
+# Caché compartida y almacén de geometrías en memoria: importar app no escribe en .cache/
+os.environ["SHARED_CACHE_URL"] = "memory://"
+os.environ["GEOMETRY_STORE_DIR"] = ""
+
+import app
+from app import SpeculativePrefetcher, extract_place_candidates, geocode_cache_key
+
+# Nombre completo que devolvería Nominatim para cada consulta
+DISPLAY_NAMES = {
+    "rue de buci": "Rue de Buci, Saint-Germain-des-Prés, Paris, Île-de-France, France",
+    "museo del prado, madrid": "Museo del Prado, Paseo del Prado, Madrid, Comunidad de Madrid, España",
+    "madrid": "Madrid, Área metropolitana de Madrid, Comunidad de Madrid, España",
+    "barcelona": "Barcelona, Barcelonès, Barcelona, Cataluña, España",
+}
+
+# Los ejemplos (few-shot) de SYSTEM_PROMPT con el plan que devolvería Gemini
+FEW_SHOT = [
+    ("Traza la Rue de Buci", [{"type": "place", "params": {"query": "Rue de Buci, Paris", "include_polygon": True}}]),
+    ("Localiza el Museo del Prado en Madrid", [{"type": "place", "params": {"query": "Museo del Prado, Madrid"}}]),
+    ("Calcula ruta de Madrid a Barcelona", [{
+        "type": "route",
+        "params": {"origin": "Madrid, España", "destination": "Barcelona, España", "profile": "driving"},
+    }]),
+]
+
+
+class FakeResponse:
+    status_code = 200
+    ok = True
+    headers = {}
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        pass
+
+
+def test_extractor_strips_command_and_article():
+    assert extract_place_candidates("Traza la Rue de Buci") == [("Rue de Buci", True, None)]
+    assert extract_place_candidates("Localiza el Museo del Prado en Madrid") == [("Museo del Prado, Madrid", False, None)]
+    assert extract_place_candidates("Calcula ruta de Madrid a Barcelona") == [
+        ("Madrid", False, None),
+        ("Barcelona", False, None),
+    ]
+    # Con mayúscula el artículo es parte del nombre
+    assert extract_place_candidates("Muestra La Paz") == [("La Paz", False, None)]
+
+
+def test_extractor_folds_commands_and_arrondissements():
+    # "Enséñame" con tilde también es un comando, no un lugar
+    assert extract_place_candidates("Enséñame dónde está El Salvador") == [("El Salvador", False, None)]
+    assert extract_place_candidates("ENSEÑAME la Puerta del Sol") == [("Puerta del Sol", False, None)]
+    # El distrito entero es un candidato, no "París"
+    assert extract_place_candidates("Muéstrame el distrito 5 de París") == [("Paris 5e Arrondissement", True, None)]
+    assert extract_place_candidates("Muéstrame el 5e arrondissement de Paris") == [
+        ("Paris 5e Arrondissement", True, None),
+    ]
+
+
+class FakeFetch:
+    """Sustituye a app.fetch_place; cada consulta se puede retener hasta `release`."""
+
+    def __init__(self, names, hold=False):
+        self.names = names
+        self.calls = []
+        self.released = threading.Event()
+        if not hold:
+            self.released.set()
+
+    def __call__(self, query, include_polygon=False, viewbox=None):
+        self.calls.append(query)
+        self.released.wait(2)
+        name = self.names.get(query)
+        if name is None:
+            raise ValueError(f"No se encontraron resultados para '{query}'.")
+        return {"query": query, "displayName": name, "lat": 40.4, "lon": -3.7}
+
+
+def with_fake_fetch(fake, test):
+    original = app.fetch_place
+    app.fetch_place = fake
+    try:
+        test()
+    finally:
+        app.fetch_place = original
+
+
+def test_prefetcher_schedules_waits_and_counts():
+    fake = FakeFetch({"Ciudad Real": "Ciudad Real, Castilla-La Mancha, España"}, hold=True)
+
+    def run():
+        prefetcher = SpeculativePrefetcher(max_candidates=4, max_pending=8, workers=2)
+        assert prefetcher.schedule("Localiza Ciudad Real y Villanueva Inexistente") == 2
+        # Ya en vuelo: no se vuelven a lanzar
+        assert prefetcher.schedule("Localiza Ciudad Real") == 0
+        threading.Timer(0.05, fake.released.set).start()
+        # Nominatim no encontró nada: el error llega al plan sin repetir la consulta
+        try:
+            prefetcher.wait_for(geocode_cache_key("Villanueva Inexistente"))
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("wait_for debería propagar el ValueError de la precarga")
+        # Como en geocode_place: si ya terminó y salió de la cola, está en caché
+        key = geocode_cache_key("Ciudad Real")
+        place = prefetcher.wait_for(key) or app.GEOCODE_CACHE.get(key)
+        assert place["displayName"].startswith("Ciudad Real")
+        prefetcher.record_use(key, ready=False)
+        # Solo cuenta la primera vez que un plan la usa
+        prefetcher.record_use(key, ready=False)
+        # Sin precarga pendiente no hay nada que esperar
+        assert prefetcher.wait_for(geocode_cache_key("Otra Ciudad")) is None
+        stats = prefetcher.stats()
+        assert (stats["scheduled"], stats["skipped"], stats["failed"], stats["hits"]) == (2, 1, 1, 2)
+        assert stats["hit_rate"] == 1.0
+        # Ya en caché: tampoco se vuelve a lanzar
+        assert prefetcher.schedule("Localiza Ciudad Real") == 0
+
+    with_fake_fetch(fake, run)
+
+
+def test_claim_extension_checks_display_name():
+    fake = FakeFetch({
+        "Toledo": "Toledo, Castilla-La Mancha, España",
+        "Valencia": "Valencia, Carabobo, Venezuela",
+    })
+
+    def run():
+        prefetcher = SpeculativePrefetcher(max_candidates=4, max_pending=8, workers=2)
+        prefetcher.schedule("Localiza Toledo y Valencia")
+        # El plan añade país: las palabras nuevas están en el nombre completo
+        place = prefetcher.claim_extension(geocode_cache_key("Toledo, España"))
+        assert place["displayName"].startswith("Toledo")
+        # Otro país: el resultado precargado no sirve
+        assert prefetcher.claim_extension(geocode_cache_key("Valencia, España")) is None
+        # Ni una clave que no amplía ninguna precargada
+        assert prefetcher.claim_extension(geocode_cache_key("Sevilla, España")) is None
+        # Con otro include_polygon es otra consulta
+        assert prefetcher.claim_extension(geocode_cache_key("Toledo, España", include_polygon=True)) is None
+        assert prefetcher.stats()["hits"] == 1
+        assert fake.calls.count("Toledo") == 1
+
+    with_fake_fetch(fake, run)
+
+
+def test_few_shot_prompts_hit_prefetch():
+    nominatim_calls = []
+
+    def fake_nominatim(method, url, **kwargs):
+        query = app.query_key(kwargs["params"]["q"])
+        nominatim_calls.append(query)
+        return FakeResponse([{
+            "display_name": DISPLAY_NAMES[query],
+            "lat": "40.4", "lon": "-3.7",
+            "osm_type": "way", "osm_id": len(query),
+            "boundingbox": ["40.3", "40.5", "-3.8", "-3.6"],
+        }])
+
+    def fake_osrm(method, url, **kwargs):
+        return FakeResponse({"code": "Ok", "waypoints": [], "routes": [{
+            "distance": 1.0, "duration": 1.0, "legs": [],
+            "geometry": {"type": "LineString", "coordinates": [[-3.7, 40.4], [2.17, 41.39]]},
+        }]})
+
+    def fake_plan(prompt, history=None):
+        time.sleep(0.05)  # Gemini tarda más que la precarga
+        return {"reply": "", "actions": dict(FEW_SHOT)[prompt]}
+
+    patched = ("request_plan_from_gemini", "NOMINATIM_MIN_INTERVAL", "OSRM_MIN_INTERVAL", "ASSISTANT_RATE_PER_MINUTE")
+    original = {name: getattr(app, name) for name in patched}
+    original_requests, original_osrm = app.requests.request, app.OSRM_SESSION.request
+    app.request_plan_from_gemini = fake_plan
+    app.NOMINATIM_MIN_INTERVAL = app.OSRM_MIN_INTERVAL = app.ASSISTANT_RATE_PER_MINUTE = 0
+    app.requests.request, app.OSRM_SESSION.request = fake_nominatim, fake_osrm
+    try:
+        client = app.create_app().test_client()
+        before = app.GEOCODE_PREFETCHER.stats()
+        for prompt, plan in FEW_SHOT:
+            calls = len(nominatim_calls)
+            response = client.post("/api/assistant", json={"prompt": prompt})
+            assert response.status_code == 200, response.get_json()
+            assert not response.get_json().get("warnings"), response.get_json()
+            # Solo las consultas de la precarga: el plan no repite ninguna
+            assert len(nominatim_calls) - calls == len(extract_place_candidates(prompt)), nominatim_calls[calls:]
+        after = app.GEOCODE_PREFETCHER.stats()
+        scheduled = after["scheduled"] - before["scheduled"]
+        assert scheduled == 4
+        assert after["hits"] - before["hits"] == scheduled
+    finally:
+        for name, value in original.items():
+            setattr(app, name, value)
+        app.requests.request, app.OSRM_SESSION.request = original_requests, original_osrm
+
+
+if __name__ == "__main__":
+    test_extractor_strips_command_and_article()
+    test_extractor_folds_commands_and_arrondissements()
+    test_prefetcher_schedules_waits_and_counts()
+    test_claim_extension_checks_display_name()
+    test_few_shot_prompts_hit_prefetch()
+    print("OK")
@@ -0,0 +1,60 @@
+import json
+import os
+
+# Caché compartida y almacén de geometrías en memoria: importar app no escribe en .cache/
+os.environ["SHARED_CACHE_URL"] = "memory://"
+os.environ["GEOMETRY_STORE_DIR"] = ""
+
+from app import iter_json_array_items
+
+ITEMS = [
+    {"display_name": "Rue de Buci, Paris", "geojson": {"type": "Point", "coordinates": [2.3372, 48.8535]}},
+    # Corchetes, llaves y comillas escapadas dentro de cadenas
+    {"display_name": "Calle \"Mayor\" [centro] {1}", "note": "a\\b\\", "osm_id": 5},
+    {
+        "display_name": "Madrid",
+        "geojson": {
+            "type": "Polygon",
+            "coordinates": [[[-3.7, 40.4], [-3.6, 40.4], [-3.6, 40.5], [-3.7, 40.5], [-3.7, 40.4]]],
+        },
+    },
+]
+PAYLOAD = json.dumps(ITEMS, ensure_ascii=False).encode("utf-8")
+
+
+def parse(chunks):
+    return [json.loads(item) for item in iter_json_array_items(chunks)]
+
+
+def test_single_chunk():
+    assert parse([PAYLOAD]) == ITEMS
+
+
+def test_every_split_point():
+    # Cualquier corte entre dos trozos (dentro de cadenas, números o pares de
+    # coordenadas) debe dar los mismos elementos.
+    for cut in range(1, len(PAYLOAD)):
+        assert parse([PAYLOAD[:cut], PAYLOAD[cut:]]) == ITEMS, cut
+
+
+def test_byte_by_byte():
+    assert parse(PAYLOAD[i:i + 1] for i in range(len(PAYLOAD))) == ITEMS
+
+
+def test_empty_chunks_and_array():
+    assert parse([b"", b"[", b"", b"]"]) == []
+    assert parse([b"[]"]) == []
+
+
+def test_stops_at_end_of_array():
+    items = iter_json_array_items([b'[{"a": 1}', b'] trailing {"b": 2}'])
+    assert [json.loads(item) for item in items] == [{"a": 1}]
+
+
+if __name__ == "__main__":
+    test_single_chunk()
+    test_every_split_point()
+    test_byte_by_byte()
+    test_empty_chunks_and_array()
+    test_stops_at_end_of_array()
+    print("OK")